@@ -0,0 +1,260 @@
+"""
+Compact binary transport between the game and the Avalam agents.
+
+An alternative to XML-RPC over a persistent Unix-domain or TCP socket.
+Every message is a frame made of a 4 bytes big-endian length followed by
+the payload.
+
+Requests:
+    opcode (1 byte), player (signed byte), step (4 bytes), time left
+    (double, NaN when untimed), rows, columns, max height (1 byte each),
+    then the board as rows * columns signed bytes. For OP_INITIALIZE the
+    player byte holds the number of players, which follow the board as
+    signed bytes.
+Responses:
+    status (1 byte), then the action as 4 signed bytes when the status is
+    STATUS_OK, or an UTF-8 error message otherwise.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import copy
+import math
+import os
+import socket
+import struct
+import threading
+import time
+
+from avalam import split_report
+
+OP_PLAY = 1
+OP_INITIALIZE = 2
+
+STATUS_OK = 0
+STATUS_NONE = 1
+STATUS_ERROR = 2
+
+FRAME_LENGTH = struct.Struct(">I")  # header of every frame
+_HEADER = struct.Struct(">BbIdBBB")
+_ACTION = struct.Struct(">4b")
+
+SCHEMES = ("unix", "tcp")
+
+
+class ProtocolError(Exception):
+
+    """Raised when the peer sends a malformed message or an error."""
+
+
+def parse_address(uri):
+    """Return (family, address) for a "unix:///path" or "tcp://host:port"
+    URI."""
+    scheme, _, rest = uri.partition("://")
+    if scheme == "unix":
+        return socket.AF_UNIX, rest
+    if scheme == "tcp":
+        host, _, port = rest.rstrip("/").rpartition(":")
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    raise ValueError("unsupported URI scheme: %s" % uri)
+
+
+def recv_exactly(sock, n):
+    """Read exactly n bytes from sock, raise EOFError if it gets closed."""
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise EOFError
+        buf += chunk
+    return bytes(buf)
+
+
+def send_frame(sock, payload):
+    sock.sendall(FRAME_LENGTH.pack(len(payload)) + payload)
+
+
+def recv_frame(sock):
+    n, = FRAME_LENGTH.unpack(recv_exactly(sock, FRAME_LENGTH.size))
+    return recv_exactly(sock, n)
+
+
+def encode_request(opcode, m, max_height, player, step, time_left,
+                   players=()):
+    rows = len(m)
+    columns = len(m[0])
+    header = _HEADER.pack(opcode, player, step,
+                          math.nan if time_left is None else time_left,
+                          rows, columns, max_height)
+    cells = struct.pack(">%db" % (rows * columns),
+                        *(x for row in m for x in row))
+    if opcode == OP_INITIALIZE:
+        cells += struct.pack(">%db" % len(players), *players)
+    return header + cells
+
+
+def decode_request(payload):
+    """Return (opcode, percepts, player, step, time_left, players)."""
+    opcode, player, step, time_left, rows, columns, max_height = \
+        _HEADER.unpack_from(payload)
+    cells = struct.unpack_from(">%db" % (rows * columns), payload,
+                               _HEADER.size)
+    m = [list(cells[i * columns:(i + 1) * columns]) for i in range(rows)]
+    percepts = {'m': m, 'rows': rows, 'columns': columns,
+                'max_height': max_height}
+    players = ()
+    if opcode == OP_INITIALIZE:
+        players = list(struct.unpack_from(">%db" % player, payload,
+                                          _HEADER.size + rows * columns))
+    if math.isnan(time_left):
+        time_left = None
+    return opcode, percepts, player, step, time_left, players
+
+
+def encode_response(action):
+    if action is None:
+        return bytes((STATUS_NONE,))
+    return bytes((STATUS_OK,)) + _ACTION.pack(*action)
+
+
+def decode_response(payload):
+    status = payload[0]
+    if status == STATUS_OK:
+        return _ACTION.unpack_from(payload, 1)
+    if status == STATUS_NONE:
+        return None
+    raise ProtocolError(payload[1:].decode("utf-8", "replace"))
+
+
+def handle_connection(agent, conn):
+    """Answer the requests received on conn until the peer closes it."""
+    while True:
+        try:
+            payload = recv_frame(conn)
+        except (EOFError, ConnectionError):
+            return
+        try:
+            opcode, percepts, player, step, time_left, players = \
+                decode_request(payload)
+            if opcode == OP_PLAY:
+                # statistics reported by the agent are not transmitted
+                action, _ = split_report(agent.play(percepts, player, step,
+                                                    time_left))
+                response = encode_response(action)
+            elif opcode == OP_INITIALIZE:
+                agent.initialize(percepts, players, time_left)
+                response = encode_response(None)
+            else:
+                raise ProtocolError("unknown opcode %d" % opcode)
+        except Exception as e:
+            response = bytes((STATUS_ERROR,)) + \
+                ("%s: %s" % (type(e).__name__, e)).encode("utf-8")
+        try:
+            send_frame(conn, response)
+        except OSError:
+            # the peer gave up on the request (timeout) and closed
+            return
+
+
+def _serve_connection(agent, conn):
+    with conn:
+        handle_connection(agent, conn)
+    agent.end_game()
+
+
+def serve_agent_binary(agent, uri):
+    """Serve agent with the binary protocol on a "unix:///path" or
+    "tcp://host:port" URI.
+
+    Every persistent connection is handled in its own thread with its own
+    shallow copy of agent, as serve_agent_multi does for its games, so
+    that both players of a game can be served by the same server.
+
+    """
+    family, address = parse_address(uri)
+    if family == socket.AF_UNIX and os.path.exists(address):
+        os.unlink(address)
+    server = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(address)
+    server.listen()
+    print("Listening on ", uri, sep="")
+    try:
+        while True:
+            conn, _ = server.accept()
+            if family == socket.AF_INET:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=_serve_connection,
+                             args=(copy.copy(agent), conn),
+                             daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if family == socket.AF_UNIX:
+            os.unlink(address)
+
+
+class BinaryAgentProxy:
+
+    """Game side of the binary protocol: a proxy for a remote Agent.
+
+    The connection is opened on the first call and kept for the whole
+    game. Calls block at most time_left + 1 seconds and raise
+    socket.timeout past it.
+
+    """
+
+    round_trip = None
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.family, self.address = parse_address(uri)
+        self.sock = None
+
+    def connect(self):
+        if self.sock is None:
+            self.sock = socket.socket(self.family, socket.SOCK_STREAM)
+            self.sock.connect(self.address)
+            if self.family == socket.AF_INET:
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                     1)
+        return self.sock
+
+    def call(self, payload, time_left):
+        sock = self.connect()
+        sock.settimeout(None if time_left is None else time_left + 1)
+        try:
+            sent = time.perf_counter()
+            send_frame(sock, payload)
+            response = recv_frame(sock)
+            self.round_trip = time.perf_counter() - sent
+            return decode_response(response)
+        except (socket.timeout, EOFError, ConnectionError):
+            self.close()
+            raise
+
+    def initialize(self, board, players, time_left):
+        return self.call(encode_request(OP_INITIALIZE, board.m,
+                                        board.max_height, len(players), 0,
+                                        time_left, players), time_left)
+
+    def play(self, board, player, step, time_left):
+        return self.call(encode_request(OP_PLAY, board.m, board.max_height,
+                                        player, step, time_left), time_left)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
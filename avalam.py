@@ -18,9 +18,56 @@ along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 """
 
+import random
+
+from instrument import instrument, profile_agent
+
 PLAYER1 = 1
 PLAYER2 = -1
 
+# returned by Agent.play_delta when the agent needs the full board
+RESYNC = "resync"
+
+
+def report(action, think_time=None, **stats):
+    """Return action together with statistics for the game to record.
+
+    Agents may return this instead of a bare action from play: think_time
+    is the time in seconds the agent measured for its search, and stats
+    any other counters (nodes, simulations, depth, ...).
+
+    """
+    stats["think_time"] = think_time
+    stats["action"] = action
+    return stats
+
+
+def split_report(result):
+    """Return (action, stats) for a value returned by Agent.play, stats
+    being empty when the agent returned a bare action."""
+    if isinstance(result, dict):
+        stats = dict(result)
+        return stats.pop("action", None), stats
+    return result, {}
+
+_zobrist_tables = {}
+
+def zobrist_table(rows, columns, max_height):
+    """Return the (cached) Zobrist keys indexed by [i][j][value + max_height].
+
+    The keys are drawn from a fixed seed so that every process computes the
+    same hash for the same position.
+
+    """
+    key = (rows, columns, max_height)
+    if key not in _zobrist_tables:
+        rng = random.Random(0xA7A1A3)
+        _zobrist_tables[key] = [[[rng.getrandbits(64)
+                                  for v in range(2 * max_height + 1)]
+                                 for j in range(columns)]
+                                for i in range(rows)]
+    return _zobrist_tables[key]
+
 class InvalidAction(Exception):
 
     """Raised when an invalid action is played."""
@@ -83,6 +130,17 @@ class Board:
         """Return a clone of this object."""
         return Board(self.m)
 
+    def get_hash(self):
+        """Return a 64 bits Zobrist hash of the position."""
+        table = zobrist_table(self.rows, self.columns, self.max_height)
+        h = 0
+        for i in range(self.rows):
+            row = self.m[i]
+            for j in range(self.columns):
+                if row[j]:
+                    h ^= table[i][j][row[j] + self.max_height]
+        return h
+
     def get_percepts(self, invert=False):
         """Return the percepts corresponding to the current state.
 
@@ -202,6 +260,10 @@ class Board:
         return score
 
 
+# counters on the hot methods when AVALAM_COUNTERS is set
+instrument(Board)
+
+
 def dict_to_board(dictio):
     """Return a clone of the board object encoded as a dictionary."""
     clone_board = Board()
@@ -211,6 +273,13 @@ def dict_to_board(dictio):
 
     return clone_board
 
+def board_to_percepts(board):
+    """Return board encoded as the dictionary a remote agent would receive."""
+    return {'m': board.get_percepts(),
+            'rows': board.rows,
+            'columns': board.columns,
+            'max_height': board.max_height}
+
 def load_percepts(filename):
     """Load percepts from a CSV file."""
     f = None
@@ -258,9 +327,60 @@ class Agent:
         step -- the current step number, starting from 1
         time_left -- a float giving the number of seconds left from the time
             credit. If the game is not time-limited, time_left is None.
+        The action may be wrapped with report() to pass search statistics.
         """
         pass
 
+    def end_game(self):
+        """End the current game, releasing what the agent holds for it.
+        Called by the servers that give each game its own agent, once the
+        game is over."""
+        pass
+
+    def play_delta(self, percepts, action, board_hash, player, step,
+                   time_left):
+        """Play and return an action, given only what changed since the
+        previous call.
+
+        The agent keeps its own copy of the board in self.delta_board: it
+        applies the opponent's action and its own. This implementation then
+        calls play with the resulting board; agents may override it to keep
+        incremental structures alive between turns.
+        Arguments:
+        percepts -- the current board as for play, or None when only the
+            opponent's action is sent.
+        action -- the action played by the opponent since the previous call,
+            or None.
+        board_hash -- "%016x" formatted Board.get_hash() of the current board
+            to check the copy against, or None.
+        player, step, time_left -- as for play.
+        Return RESYNC instead of an action if the copy cannot be brought up
+        to date; the game then calls again with the full board.
+        """
+        if percepts is not None:
+            self.delta_board = dict_to_board(percepts)
+        else:
+            board = getattr(self, "delta_board", None)
+            if board is None:
+                return RESYNC
+            try:
+                if action is not None:
+                    board.play_action(tuple(action))
+            except InvalidAction:
+                self.delta_board = None
+                return RESYNC
+            if board_hash is not None and \
+                    "%016x" % board.get_hash() != board_hash:
+                self.delta_board = None
+                return RESYNC
+        result = self.play(board_to_percepts(self.delta_board), player, step,
+                           time_left)
+        try:
+            self.delta_board.play_action(tuple(split_report(result)[0]))
+        except (InvalidAction, TypeError):
+            self.delta_board = None
+        return result
+
 
 def serve_agent(agent, address, port):
     """Serve agent on specified bind address and port number."""
@@ -274,6 +394,131 @@ def serve_agent(agent, address, port):
         pass
 
 
+_game_prototype = None
+_game_agents = {}
+
+
+def _init_game_worker(prototype):
+    """Initializer of the worker processes of serve_agent_multi."""
+    global _game_prototype
+    _game_prototype = prototype
+
+
+def _call_game_agent(game_id, fn, args):
+    """Call fn(*args) on the agent of game_id in this worker process,
+    creating the agent on the first call of the game."""
+    import copy
+    if fn == "end_game":
+        agent = _game_agents.pop(game_id, None)
+        if agent is not None:
+            agent.end_game()
+        return None
+    agent = _game_agents.get(game_id)
+    if agent is None:
+        agent = copy.copy(_game_prototype)
+        _game_agents[game_id] = agent
+    return getattr(agent, fn)(*args)
+
+
+class MultiGameDispatcher:
+
+    """XML-RPC instance of serve_agent_multi.
+
+    Every method takes the id of the game as first argument. The games are
+    spread over worker processes, a game always being played by the same
+    worker so that its agent keeps its state between moves.
+
+    """
+
+    def __init__(self, agent, workers):
+        import concurrent.futures
+        import multiprocessing
+        import threading
+        context = multiprocessing.get_context("fork")
+        self.executors = [concurrent.futures.ProcessPoolExecutor(
+                              1, mp_context=context,
+                              initializer=_init_game_worker,
+                              initargs=(agent,))
+                          for _ in range(workers)]
+        # start the workers now, before the server socket is opened, so
+        # that they do not inherit it
+        for executor in self.executors:
+            executor.submit(int).result()
+        self.load = [0] * workers
+        self.games = {}
+        self.lock = threading.Lock()
+
+    def _call(self, game_id, fn, *args):
+        with self.lock:
+            worker = self.games.get(game_id)
+            if worker is None:
+                worker = self.load.index(min(self.load))
+                self.games[game_id] = worker
+                self.load[worker] += 1
+        future = self.executors[worker].submit(_call_game_agent, game_id, fn,
+                                               args)
+        return future.result()
+
+    def initialize(self, game_id, percepts, players, time_left):
+        return self._call(game_id, "initialize", percepts, players, time_left)
+
+    def play(self, game_id, percepts, player, step, time_left):
+        return self._call(game_id, "play", percepts, player, step, time_left)
+
+    def play_delta(self, game_id, percepts, action, board_hash, player, step,
+                   time_left):
+        return self._call(game_id, "play_delta", percepts, action, board_hash,
+                          player, step, time_left)
+
+    def end_game(self, game_id):
+        """Forget the agent of game_id."""
+        with self.lock:
+            worker = self.games.pop(game_id, None)
+            if worker is None:
+                return None
+            self.load[worker] -= 1
+        return self.executors[worker].submit(_call_game_agent, game_id,
+                                             "end_game", ()).result()
+
+    def _shutdown(self):
+        # not dispatched over XML-RPC, as its name starts with an underscore
+        for executor in self.executors:
+            executor.shutdown(cancel_futures=True)
+
+
+def serve_agent_multi(agent, address, port, workers):
+    """Serve agent for many simultaneous games on specified bind address and
+    port number.
+
+    Requests are handled in threads and the searches run in workers
+    processes. Each game, identified by the id the caller passes as first
+    argument, gets its own shallow copy of agent: tables loaded on agent
+    before serving (opening book, endgame cache, ...) are shared read-only
+    by all games, while the attributes an agent assigns during a game stay
+    private to it.
+
+    """
+    from socketserver import ThreadingMixIn
+    from xmlrpc.server import SimpleXMLRPCServer
+
+    class ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+        daemon_threads = True
+
+    dispatcher = MultiGameDispatcher(agent, workers)
+    server = ThreadingXMLRPCServer((address, port), allow_none=True,
+                                   logRequests=False)
+    server.register_instance(dispatcher)
+    print("Listening on ", address, ":", port, " (", workers, " workers)",
+          sep="")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dispatcher._shutdown()
+
+
 def agent_main(agent, args_cb=None, setup_cb=None):
     """Launch agent server depending on arguments.
     Arguments:
@@ -300,10 +545,29 @@ def agent_main(agent, args_cb=None, setup_cb=None):
                         help="bind to address ADDRESS (default: *)")
     parser.add_argument("-p", "--port", type=portarg, default=8000,
                         help="set port number (default: %(default)s)")
+    parser.add_argument("--listen", metavar="URI",
+                        help="serve with the compact binary protocol on URI" +
+                             " (unix:///path or tcp://host:port) instead" +
+                             " of XML-RPC")
+    parser.add_argument("--multi-game", type=int, metavar="WORKERS",
+                        help="serve many simultaneous games, identified by" +
+                             " the caller, with WORKERS search processes")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="dump a cProfile profile of every move in DIR" +
+                             " (default: $AVALAM_PROFILE, if set)")
     if args_cb is not None:
         args_cb(agent, parser)
     args = parser.parse_args()
     if setup_cb is not None:
         setup_cb(agent, parser, args)
-
-    serve_agent(agent, args.address, args.port)
\ No newline at end of file
+    profile_agent(agent, args.profile)
+
+    if args.multi_game is not None:
+        if args.multi_game < 1:
+            parser.error("the number of workers must be at least 1")
+        serve_agent_multi(agent, args.address, args.port, args.multi_game)
+    elif args.listen is not None:
+        from agent_protocol import serve_agent_binary
+        serve_agent_binary(agent, args.listen)
+    else:
+        serve_agent(agent, args.address, args.port)
\ No newline at end of file
@@ -1,5 +1,9 @@
-from avalam import Board
+import numpy as np
 
+from avalam import Board, zobrist_table
+from instrument import instrument
+
+@instrument
 class CustomBoard(Board):
 
     # initial_board = array(Board.initial_board)
@@ -32,6 +36,182 @@ class CustomBoard(Board):
                     score_mov += delta
         return score, score_mov, score_max_height
 
+
+@instrument
+class ActiveCellBoard(CustomBoard):
+
+    """CustomBoard keeping track of its active cells.
+
+    A tower with no valid action to or from any neighbour never changes
+    again: heights only grow and emptied cells stay empty. Such frozen
+    towers are dropped from self.active, the list of the other towers in
+    row-major order, and their contribution to get_scores is kept in
+    self.frozen as (score, score_mov, score_max_height). get_towers,
+    get_actions, is_finished, get_score and get_scores only visit the
+    active cells, whose number decreases as the game progresses. The
+    Zobrist hash of get_hash is updated at every move.
+
+    """
+
+    neighbours = [(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1)
+                  if di or dj]
+
+    def __init__(self, percepts=Board.initial_board, max_height=Board.max_height, invert=False):
+        super().__init__(percepts, max_height, invert)
+        self.active = [(i, j) for i in range(self.rows)
+                       for j in range(self.columns) if self.m[i][j]]
+        self.frozen = (0, 0, 0)
+        self.freeze(set(self.active))
+        self.zobrist = zobrist_table(self.rows, self.columns, self.max_height)
+        self.hash = super().get_hash()
+
+    def clone(self):
+        """Return a clone of this object."""
+        board = ActiveCellBoard.__new__(ActiveCellBoard)
+        board.m = [row[:] for row in self.m]
+        board.rows = self.rows
+        board.columns = self.columns
+        board.max_height = self.max_height
+        board.active = self.active  # replaced, never modified in place
+        board.frozen = self.frozen
+        board.zobrist = self.zobrist
+        board.hash = self.hash
+        return board
+
+    def get_hash(self):
+        """Return a 64 bits Zobrist hash of the position."""
+        return self.hash
+
+    def is_frozen(self, i, j):
+        """Return whether tower (i,j) can no longer move nor be moved
+        onto."""
+        h = abs(self.m[i][j])
+        if h >= self.max_height:
+            return True
+        for di, dj in self.neighbours:
+            i2, j2 = i + di, j + dj
+            if 0 <= i2 < self.rows and 0 <= j2 < self.columns:
+                h2 = abs(self.m[i2][j2])
+                if h2 and h + h2 <= self.max_height:
+                    return False
+        return True
+
+    def freeze(self, cells):
+        """Drop the frozen towers among cells from the active cells."""
+        score, score_mov, score_max_height = self.frozen
+        active = []
+        for (i, j) in self.active:
+            if (i, j) in cells and self.is_frozen(i, j):
+                delta = 1 if self.m[i][j] > 0 else -1
+                score += delta
+                if abs(self.m[i][j]) == self.max_height:
+                    score_max_height += delta
+                else:
+                    score_mov += delta
+            else:
+                active.append((i, j))
+        self.active = active
+        self.frozen = (score, score_mov, score_max_height)
+
+    def play_action(self, action):
+        try:
+            i1, j1, i2, j2 = action
+            v1, v2 = self.m[i1][j1], self.m[i2][j2]
+        except (TypeError, ValueError, IndexError):
+            v1 = v2 = None  # rejected below
+        super().play_action(action)
+        table, offset = self.zobrist, self.max_height
+        self.hash ^= table[i1][j1][v1 + offset] ^ \
+            table[i2][j2][v2 + offset] ^ \
+            table[i2][j2][self.m[i2][j2] + offset]
+        # only the towers around the two cells may have frozen
+        cells = {(i1 + di, j1 + dj) for di, dj in self.neighbours}
+        cells.update((i2 + di, j2 + dj) for di, dj in self.neighbours)
+        cells.add((i2, j2))
+        self.active = [c for c in self.active if c != (i1, j1)]
+        self.freeze(cells)
+        return self
+
+    def get_towers(self):
+        """Yield the active towers as triplets (i, j, h), the frozen ones
+        having no action."""
+        m = self.m
+        for i, j in self.active:
+            yield (i, j, m[i][j])
+
+    def is_finished(self):
+        # every active tower has an action
+        return not self.active
+
+    def get_score(self):
+        score = self.frozen[0]
+        for i, j in self.active:
+            score += 1 if self.m[i][j] > 0 else -1
+        if score == 0:
+            # active towers are below the maximal height
+            score = self.frozen[2]
+        return score
+
+    def get_scores(self):
+        score, score_mov, score_max_height = self.frozen
+        for i, j in self.active:
+            score += 1 if self.m[i][j] > 0 else -1
+        return score, score_mov, score_max_height
+
+    def get_moves_left_bound(self):
+        """Return an upper bound of the number of moves left.
+
+        Every move removes one tower and changes the tower count score by
+        exactly one, and the active towers cannot end as fewer towers than
+        their total height divided by the maximal height.
+
+        """
+        if not self.active:
+            return 0
+        height = sum(abs(self.m[i][j]) for i, j in self.active)
+        return len(self.active) - -(-height // self.max_height)
+
+
+def batch_scores(board, actions):
+    """Return the get_scores of the boards resulting from every action of
+    actions on board, computed at once on arrays without any clone.
+
+    Return (score, score_mov, score_max_height, finished), four arrays
+    indexed as actions, finished telling whether no move is left.
+
+    """
+    max_height = board.max_height
+    actions = np.asarray(actions, np.intp).reshape(-1, 4)
+    n = len(actions)
+    k = np.arange(n)
+    i1, j1, i2, j2 = actions.T
+    m = np.array(board.m, np.int8)
+    v1 = m[i1, j1]
+    v2 = m[i2, j2]
+    children = np.repeat(m[np.newaxis], n, axis=0)
+    children[k, i1, j1] = 0
+    children[k, i2, j2] = np.where(v1 < 0, -1, 1) * (np.abs(v1) + np.abs(v2))
+    sign = np.sign(children)
+    height = np.abs(children)
+    # heights surrounded by empty cells, to look at the 8 neighbours
+    padded = np.zeros((n, board.rows + 2, board.columns + 2), np.int8)
+    padded[:, 1:-1, 1:-1] = height
+    movable = np.zeros(height.shape, bool)
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            if di or dj:
+                neighbour = padded[:, 1 + di:board.rows + 1 + di,
+                                   1 + dj:board.columns + 1 + dj]
+                movable |= (neighbour > 0) & (height + neighbour <= max_height)
+    movable &= (height > 0) & (height < max_height)
+    is_max_height = height == max_height
+    score = sign.sum(axis=(1, 2), dtype=np.int64)
+    score_max_height = (sign * is_max_height).sum(axis=(1, 2), dtype=np.int64)
+    score_mov = (sign * (~is_max_height & ~movable)).sum(axis=(1, 2), dtype=np.int64)
+    finished = ~movable.any(axis=(1, 2))
+    return score, score_mov, score_max_height, finished
+
+
 def dict_to_board_custom(dictio):
     """Return a clone of the board object encoded as a dictionary."""
     clone_board = CustomBoard()
@@ -39,4 +219,9 @@ def dict_to_board_custom(dictio):
     clone_board.rows = dictio['rows']
     clone_board.max_height = dictio['max_height']
 
-    return clone_board    
\ No newline at end of file
+    return clone_board    
+
+
+def dict_to_board_active(dictio):
+    """Return an ActiveCellBoard for the board encoded as a dictionary."""
+    return ActiveCellBoard(dictio['m'], dictio['max_height'])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Bounded cache of position evaluations for the Avalam agents.
+
+Evaluations are keyed by the Zobrist hash of the position (Board.get_hash)
+and the least recently used ones are evicted once the cache is full. The
+cache is distinct from any transposition table: it only holds static
+evaluations, which do not depend on the search depth or window.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+from collections import OrderedDict
+
+
+class EvalCache:
+
+    """LRU cache of evaluations, keyed by position hash, of at most
+    max_entries entries, counting its hits and misses."""
+
+    def __init__(self, max_entries=1 << 16):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return the evaluation of key, or None if it is not cached."""
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Cache the evaluation value of key, evicting the least recently
+        used entry if the cache is full."""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def evaluate(self, board, fn):
+        """Return fn(board), cached under board.get_hash()."""
+        key = board.get_hash()
+        value = self.get(key)
+        if value is None:
+            value = fn(board)
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        """Return the counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self.entries),
+                "hit_rate": self.hits / lookups if lookups else None}
@@ -21,14 +21,24 @@ along with this program; if not, see <http://www.gnu.org/licenses/>.
 import signal
 
 import logging
+import multiprocessing
+import os
+import sys
 import time
 import socket
 import xmlrpc.client
 import pickle
+import json
+import math
+import mmap
+import struct
 import importlib
+import importlib.util
 import subprocess
 
 from avalam import *
+import agent_protocol
+from instrument import profile_agent
 
 
 class TimeCreditExpired(Exception):
@@ -130,6 +140,35 @@ class ConsoleViewer(Viewer):
             print("Reason:", reason)
 
 
+# Binary trace format: a header, the initial board as rows * columns signed
+# bytes, then one fixed-size record per move and a final record with the
+# winner. Records are appended and flushed as the game goes, so the trace
+# of an interrupted game keeps its moves.
+TRACE_MAGIC = b"AVTR"
+TRACE_VERSION = 1
+# magic, version, rows, columns, max_height, time limits (NaN if none)
+_TRACE_HEADER = struct.Struct(">4sBBBBdd")
+# player, action, think time
+_TRACE_MOVE = struct.Struct(">b4bf")
+# 0, winner, reason code, think time slot (unused)
+_TRACE_END = struct.Struct(">bhBxf")
+INTERRUPTED = "Game interrupted."
+OTHER_REASON = "Other reason."
+# reasons by code, any reason missing from the list is written as
+# OTHER_REASON
+TRACE_REASONS = ["", "Opponent's time credit has expired.",
+                 "Opponent has played an invalid action.", INTERRUPTED,
+                 OTHER_REASON]
+
+
+def reason_code(reason):
+    """Return the code of reason in the binary trace format."""
+    try:
+        return TRACE_REASONS.index(reason)
+    except ValueError:
+        return TRACE_REASONS.index(OTHER_REASON)
+
+
 class Trace:
 
     """Keep track of a played game.
@@ -160,6 +199,30 @@ class Trace:
         self.actions = []
         self.winner = 0
         self.reason = ""
+        self.stream = None
+
+    def stream_to(self, f):
+        """Write the trace to the binary file f as the game goes.
+
+        The header and the actions already played are written immediately,
+        every later action and the winner are appended and flushed as soon
+        as they are known.
+
+        """
+        f.write(self.encode_header())
+        for player, action, t in self.actions:
+            f.write(_TRACE_MOVE.pack(player, *action, t))
+        f.flush()
+        self.stream = f
+
+    def encode_header(self):
+        board = self.initial_board
+        limits = [math.nan if t is None else t for t in self.time_limits]
+        return _TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, board.rows,
+                                  board.columns, board.max_height,
+                                  *limits) + \
+            struct.pack(">%db" % (board.rows * board.columns),
+                        *(x for row in board.m for x in row))
 
     def add_action(self, player, action, t):
         """Add an action to the trace.
@@ -173,6 +236,9 @@ class Trace:
 
         """
         self.actions.append((player, action, t))
+        if self.stream is not None:
+            self.stream.write(_TRACE_MOVE.pack(player, *action, t))
+            self.stream.flush()
 
     def set_winner(self, winner, reason):
         """Set the winner.
@@ -184,26 +250,178 @@ class Trace:
         """
         self.winner = winner
         self.reason = reason
+        if self.stream is not None:
+            self.stream.write(_TRACE_END.pack(0, winner,
+                                              reason_code(reason), 0))
+            self.stream.flush()
+            self.stream = None
 
     def get_initial_board(self):
         """Return a Board instance representing the initial board."""
         return self.initial_board.clone()
 
     def write(self, f):
-        """Write the trace to a file."""
-        pickle.dump(self, f)
+        """Write the trace to a binary file."""
+        f.write(self.encode_header())
+        for player, action, t in self.actions:
+            f.write(_TRACE_MOVE.pack(player, *action, t))
+        f.write(_TRACE_END.pack(0, self.winner,
+                                reason_code(self.reason), 0))
+
+    def write_pickle(self, f):
+        """Write the trace to a file in the former pickle format."""
+        stream = self.stream
+        self.stream = None
+        try:
+            pickle.dump(self, f)
+        finally:
+            self.stream = stream
+
+
+class ReplayBoards:
+
+    """Boards of a replayed game, rebuilt on demand.
+
+    boards[step] is the Board before the action of step step is played
+    (boards[0] is the initial board). Only one board every interval steps
+    is kept, as a checkpoint: the others are rebuilt from the closest
+    previous checkpoint, so any step is reached in at most interval - 1
+    actions and the memory used is a fraction of the game length.
+    Checkpoints are made as the game is traversed, so that a replay can
+    start immediately and its trace may still grow.
+
+    """
+
+    def __init__(self, trace, interval=8):
+        self.trace = trace
+        self.interval = interval
+        self.checkpoints = [trace.get_initial_board()]
+
+    def __len__(self):
+        return len(self.trace.actions) + 1
+
+    def __getitem__(self, step):
+        if step < 0:
+            step += len(self)
+        if not 0 <= step < len(self):
+            raise IndexError(step)
+        k = min(step // self.interval, len(self.checkpoints) - 1)
+        board = self.checkpoints[k].clone()
+        for s in range(k * self.interval, step):
+            board.play_action(self.trace.actions[s][1])
+            if (s + 1) % self.interval == 0 and \
+                    (s + 1) // self.interval == len(self.checkpoints):
+                self.checkpoints.append(board.clone())
+        return board
+
+
+class TraceReader:
+
+    """Random access to a binary trace held in a buffer (bytes or mmap).
+
+    Attributes:
+    time_limits, initial_board -- as in Trace
+    finished -- whether the trace ends with the result of the game
+    winner, reason -- result of the game, (0, INTERRUPTED) if not finished
+
+    len(reader) is the number of moves and reader[i] the (player, action,
+    time) tuple of move i, read from the buffer on access.
+
+    """
+
+    def __init__(self, buf):
+        magic, version, rows, columns, max_height, t1, t2 = \
+            _TRACE_HEADER.unpack_from(buf)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError("not an Avalam binary trace")
+        cells = struct.unpack_from(">%db" % (rows * columns), buf,
+                                   _TRACE_HEADER.size)
+        self.initial_board = Board([list(cells[i * columns:(i + 1) * columns])
+                                    for i in range(rows)], max_height)
+        self.time_limits = [None if math.isnan(t) else t for t in (t1, t2)]
+        self.buf = buf
+        self.offset = _TRACE_HEADER.size + rows * columns
+        n = (len(buf) - self.offset) // _TRACE_MOVE.size
+        self.finished = False
+        self.winner = 0
+        self.reason = INTERRUPTED
+        if n and buf[self.offset + (n - 1) * _TRACE_MOVE.size] == 0:
+            n -= 1
+            _, self.winner, reason, _ = _TRACE_END.unpack_from(
+                buf, self.offset + n * _TRACE_MOVE.size)
+            self.reason = TRACE_REASONS[reason]
+            self.finished = True
+        self.moves = n
+
+    def __len__(self):
+        return self.moves
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.moves:
+            raise IndexError(i)
+        player, i1, j1, i2, j2, t = _TRACE_MOVE.unpack_from(
+            self.buf, self.offset + i * _TRACE_MOVE.size)
+        return (player, (i1, j1, i2, j2), t)
+
+    def to_trace(self):
+        """Return the Trace."""
+        trace = Trace(self.initial_board, self.time_limits)
+        trace.actions = [self[i] for i in range(self.moves)]
+        trace.winner = self.winner
+        trace.reason = self.reason
+        return trace
+
+
+def open_trace(path):
+    """Memory-map the binary trace at path and return a TraceReader."""
+    with open(path, "rb") as f:
+        return TraceReader(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def iter_trace(f):
+    """Stream a binary trace from the file object f.
+
+    Yield the Trace without actions first, then every (player, action,
+    time) tuple as it is read, which works on a trace still being written.
+    The winner and reason of the first Trace are set once the final record
+    is read.
+
+    """
+    buf = f.read(_TRACE_HEADER.size)
+    magic, version, rows, columns, max_height, t1, t2 = \
+        _TRACE_HEADER.unpack(buf)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError("not an Avalam binary trace")
+    reader = TraceReader(buf + f.read(rows * columns))
+    trace = Trace(reader.initial_board, reader.time_limits)
+    trace.reason = INTERRUPTED
+    yield trace
+    while True:
+        record = f.read(_TRACE_MOVE.size)
+        if len(record) < _TRACE_MOVE.size:
+            return
+        if record[0] == 0:
+            _, trace.winner, reason, _ = _TRACE_END.unpack(record)
+            trace.reason = TRACE_REASONS[reason]
+            return
+        player, i1, j1, i2, j2, t = _TRACE_MOVE.unpack(record)
+        yield (player, (i1, j1, i2, j2), t)
 
 
 def load_trace(f):
-    """Load a trace from a file."""
-    return pickle.load(f)
+    """Load a trace from a file, in the binary or the pickle format."""
+    data = f.read()
+    if data[:len(TRACE_MAGIC)] == TRACE_MAGIC:
+        return TraceReader(data).to_trace()
+    return pickle.loads(data)
 
 
 class Game:
 
     """Main Avalam game class."""
 
-    def __init__(self, agents, board, viewer=None, credits=[None, None]):
+    def __init__(self, agents, board, viewer=None, credits=[None, None],
+                 delta=False, resync_period=10, metrics=None):
         """New Avalam game.
 
         Arguments:
@@ -213,6 +431,14 @@ class Game:
         viewer -- the viewer or None if none should be used
         credits -- a sequence of 2 elements containing the time credit in
             seconds for each agent, or None for a time-unlimitted agent
+        delta -- whether to send agents only the opponent's last action
+            (Agent.play_delta) instead of the full board, when they support
+            it
+        resync_period -- in delta mode, number of calls to an agent between
+            two board hashes sent to check its copy of the board
+        metrics -- file to write the latency record of every agent call to,
+            as JSON lines, followed by their summary at the end of the game,
+            or None
 
         """
         self.agents = agents
@@ -222,6 +448,13 @@ class Game:
         self.step = 0
         self.player = 1
         self.trace = Trace(board, credits)
+        self.delta = delta
+        self.resync_period = resync_period
+        self.synced = [False, False]
+        self.delta_calls = [0, 0]
+        self.last_action = None
+        self.metrics = metrics
+        self.call_metrics = []
 
     def startPlaying(self):
         self.viewer.init_viewer(self.board.clone(), game=self)
@@ -246,11 +479,15 @@ class Game:
                 logging.debug("Asking player %d to play step %d",
                               self.player, self.step)
                 self.viewer.playing(self.step, self.player)
-                action, t = self.timed_exec("play",
-                                            self.board,
-                                            self.player,
-                                            self.step)
+                if self.uses_delta():
+                    action, t = self.play_delta()
+                else:
+                    action, t = self.timed_exec("play",
+                                                self.board,
+                                                self.player,
+                                                self.step)
                 self.board.play_action(action)
+                self.last_action = action
                 self.viewer.update(self.step, action, self.player)
                 self.trace.add_action(self.player, action, t)
                 self.player = -self.player
@@ -277,8 +514,49 @@ class Game:
         else:
             logging.info("Winner: draw game")
         self.trace.set_winner(winner, reason)
+        if self.metrics is not None:
+            summary = latency_summary(self.call_metrics)
+            for field, stats in summary.items():
+                logging.info("%s: %s", field, format_latency(stats))
+            summary["type"] = "summary"
+            self.metrics.write(json.dumps(summary) + "\n")
+            self.metrics.flush()
         self.viewer.finished(self.step, winner, reason)
 
+    def uses_delta(self):
+        """Return whether the current player is sent deltas."""
+        agent = self.agents[0 if self.player > 0 else 1]
+        return self.delta and not isinstance(agent, Viewer) and \
+            hasattr(agent, "play_delta")
+
+    def play_delta(self):
+        """Ask the current player to play with Agent.play_delta.
+
+        The full board is sent on the first call, and again whenever the
+        agent answers RESYNC. Otherwise only the opponent's last action is,
+        with the board hash every resync_period calls. Return a tuple
+        (action, t) as timed_exec.
+
+        """
+        agent = 0 if self.player > 0 else 1
+        t = 0.0
+        if self.synced[agent]:
+            board_hash = None
+            self.delta_calls[agent] += 1
+            if self.delta_calls[agent] % self.resync_period == 0:
+                board_hash = "%016x" % self.board.get_hash()
+            result, t = self.timed_exec("play_delta", None, self.last_action,
+                                        board_hash, self.player, self.step)
+            if result != RESYNC:
+                return (result, t)
+            logging.debug("Player %d asked for the full board", agent + 1)
+        result, t2 = self.timed_exec("play_delta", self.board, None, None,
+                                     self.player, self.step)
+        if result == RESYNC:
+            raise InvalidAction
+        self.synced[agent] = True
+        return (result, t + t2)
+
     def timed_exec(self, fn, *args, agent=None):
         """Execute self.agents[agent].fn(*args, time_left) with the
         time limit for the current player.
@@ -297,9 +575,11 @@ class Game:
             if self.credits[agent] < 0:
                 raise TimeCreditExpired
             socket.setdefaulttimeout(self.credits[agent] + 1)
+        clear_round_trip(self.agents[agent])
         start = time.time()
         try:
-            result = self.agents[agent].play(*args + (self.credits[agent],))
+            result = getattr(self.agents[agent], fn)(*args + (self.credits[agent],))
+            result, stats = split_report(result)
         except socket.timeout:
             self.credits[agent] = -1.0  # ensure it is counted as expired
             raise TimeCreditExpired
@@ -322,12 +602,326 @@ class Game:
                           self.credits[agent])
             if self.credits[agent] < -0.5:  # small epsilon to be sure
                 raise TimeCreditExpired
+        if self.metrics is not None:
+            self.record_call(fn, agent, t, stats)
         return (result, t)
 
+    def record_call(self, fn, agent, t, stats):
+        """Record the latency breakdown of a call to an agent.
+
+        round_trip is the time between sending the request and receiving
+        the answer as measured by the transport, serialization the rest of
+        the call time (encoding, decoding, proxy overhead) and network the
+        round trip minus the think time reported by the agent.
+
+        """
+        round_trip = get_round_trip(self.agents[agent])
+        think = stats.pop("think_time", None)
+        record = {"type": "call",
+                  "step": self.step,
+                  "player": agent + 1,
+                  "function": fn,
+                  "wall": t,
+                  "round_trip": round_trip,
+                  "serialization": None if round_trip is None
+                                   else t - round_trip,
+                  "think_time": think,
+                  "network": None if round_trip is None or think is None
+                             else round_trip - think,
+                  "credit_left": self.credits[agent]}
+        record.update(stats)
+        self.call_metrics.append(record)
+        self.metrics.write(json.dumps(record) + "\n")
+        self.metrics.flush()
+
+
+LATENCY_FIELDS = ("wall", "round_trip", "serialization", "network",
+                  "think_time")
+# upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = [b * 10 ** e for e in range(-5, 2) for b in (1, 2, 5)]
+
+
+def latency_summary(records, fields=LATENCY_FIELDS):
+    """Summarize the fields of call records.
+
+    Return a dictionary mapping every field with values to a dictionary
+    with their count, mean, median, 90th percentile, max and histogram, a
+    list of [upper bound in seconds, count] with None as the last bound.
+
+    """
+    summary = {}
+    for field in fields:
+        values = sorted(r[field] for r in records
+                        if r.get(field) is not None)
+        if not values:
+            continue
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        k = 0
+        for v in values:
+            while k < len(LATENCY_BUCKETS) and v > LATENCY_BUCKETS[k]:
+                k += 1
+            counts[k] += 1
+        summary[field] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": values[len(values) // 2],
+            "p90": values[min(len(values) - 1, len(values) * 9 // 10)],
+            "max": values[-1],
+            "histogram": [[b, c] for b, c in
+                          zip(LATENCY_BUCKETS + [None], counts) if c]}
+    return summary
+
+
+def format_latency(stats):
+    """Return a one line text rendering of a latency_summary entry."""
+    def ms(t):
+        return "%.4gms" % (t * 1000)
+    bars = " ".join("<=%s:%d" % (ms(b) if b is not None else "inf", c)
+                    for b, c in stats["histogram"])
+    return "n=%d mean=%s p50=%s p90=%s max=%s | %s" % (
+        stats["count"], ms(stats["mean"]), ms(stats["p50"]),
+        ms(stats["p90"]), ms(stats["max"]), bars)
+
+
+class TimedTransport(xmlrpc.client.Transport):
+
+    """XML-RPC transport recording the round trip of the last request,
+    from the start of its sending to the reception of the response
+    headers."""
+
+    round_trip = None
+
+    def send_request(self, host, handler, request_body, debug):
+        self.sent = time.perf_counter()
+        return super().send_request(host, handler, request_body, debug)
+
+    def parse_response(self, response):
+        self.round_trip = time.perf_counter() - self.sent
+        return super().parse_response(response)
+
+
+def get_round_trip(agent):
+    """Return the round trip of the last call to agent as measured by its
+    transport, or None if it has none."""
+    if isinstance(agent, xmlrpc.client.ServerProxy):
+        agent = agent("transport")
+    return getattr(agent, "round_trip", None)
+
+
+def clear_round_trip(agent):
+    if isinstance(agent, xmlrpc.client.ServerProxy):
+        agent = agent("transport")
+    if isinstance(agent, (TimedTransport, ProcessAgent,
+                          agent_protocol.BinaryAgentProxy)):
+        agent.round_trip = None
+    elif isinstance(agent, GameAgentProxy):
+        clear_round_trip(agent.proxy)
+
 
 def connect_agent(uri):
-    """Connect to a remote player and return a proxy for the Player object."""
-    return xmlrpc.client.ServerProxy(uri, allow_none=True)
+    """Connect to a remote player and return a proxy for the Player object.
+
+    unix:// and tcp:// URIs use the binary protocol of agent_protocol, any
+    other URI uses XML-RPC.
+
+    """
+    if uri.partition("://")[0] in agent_protocol.SCHEMES:
+        return agent_protocol.BinaryAgentProxy(uri)
+    transport = TimedTransport() if uri.startswith("http:") else None
+    return xmlrpc.client.ServerProxy(uri, transport=transport,
+                                     allow_none=True)
+
+
+def load_agent_class(spec):
+    """Import and return the agent class designated by "path.py:ClassName".
+
+    Raise ImportError, or any error raised by the module, if the file cannot
+    be imported and AttributeError if it has no such class.
+
+    """
+    path, _, name = spec.rpartition(":")
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    module_spec = importlib.util.spec_from_file_location(module_name, path)
+    if module_spec is None:
+        raise ImportError("not a Python file: %s" % path)
+    module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(module)
+    return getattr(module, name)
+
+
+class LocalAgent:
+
+    """Agent running in the game process.
+
+    Calls are forwarded to the wrapped Agent instance with the board encoded
+    as for a remote agent, without any serialization.
+
+    """
+
+    def __init__(self, agent):
+        self.agent = agent
+
+    def initialize(self, board, players, time_left):
+        return self.agent.initialize(board_to_percepts(board), players,
+                                     time_left)
+
+    def play(self, board, player, step, time_left):
+        return self.agent.play(board_to_percepts(board), player, step,
+                               time_left)
+
+    def play_delta(self, board, action, board_hash, player, step, time_left):
+        return self.agent.play_delta(
+            None if board is None else board_to_percepts(board), action,
+            board_hash, player, step, time_left)
+
+
+def _agent_process(conn, spec):
+    """Main loop of the child process of a ProcessAgent."""
+    try:
+        agent = profile_agent(load_agent_class(spec)())
+    except Exception as e:
+        conn.send((False, "%s: %s" % (type(e).__name__, e)))
+        return
+    conn.send((True, None))
+    while True:
+        try:
+            fn, args = conn.recv()
+        except EOFError:
+            break
+        try:
+            conn.send((True, getattr(agent, fn)(*args)))
+        except Exception as e:
+            conn.send((False, "%s: %s" % (type(e).__name__, e)))
+
+
+class ProcessAgent:
+
+    """Agent running in a dedicated child process, connected by a pipe.
+
+    The time credit is enforced: a call not answered within the remaining
+    credit raises socket.timeout, as a remote agent would. ImportError is
+    raised if the child process cannot create the agent.
+
+    """
+
+    round_trip = None
+
+    def __init__(self, spec):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_agent_process,
+                                               args=(child_conn, spec),
+                                               daemon=True)
+        self.process.start()
+        child_conn.close()
+        try:
+            ok, error = self.conn.recv()
+        except EOFError:
+            ok, error = False, "the agent process exited"
+        if not ok:
+            self.close()
+            raise ImportError(error)
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def call(self, fn, *args, timeout=None):
+        sent = time.perf_counter()
+        self.conn.send((fn, args))
+        if not self.conn.poll(timeout):
+            self.close()
+            raise socket.timeout
+        self.round_trip = time.perf_counter() - sent
+        ok, result = self.conn.recv()
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def initialize(self, board, players, time_left):
+        return self.call("initialize", board_to_percepts(board), players,
+                         time_left,
+                         timeout=None if time_left is None else time_left + 1)
+
+    def play(self, board, player, step, time_left):
+        return self.call("play", board_to_percepts(board), player, step,
+                         time_left,
+                         timeout=None if time_left is None else time_left + 1)
+
+    def play_delta(self, board, action, board_hash, player, step, time_left):
+        return self.call("play_delta",
+                         None if board is None else board_to_percepts(board),
+                         action, board_hash, player, step, time_left,
+                         timeout=None if time_left is None else time_left + 1)
+
+    def close(self):
+        """Stop the child process."""
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+
+class GameAgentProxy:
+
+    """Proxy for one game of an agent served by avalam.serve_agent_multi."""
+
+    def __init__(self, proxy, game_id):
+        self.proxy = proxy
+        self.game_id = game_id
+
+    def initialize(self, board, players, time_left):
+        return self.proxy.initialize(self.game_id, board, players, time_left)
+
+    def play(self, board, player, step, time_left):
+        return self.proxy.play(self.game_id, board, player, step, time_left)
+
+    def play_delta(self, board, action, board_hash, player, step, time_left):
+        return self.proxy.play_delta(self.game_id, board, action, board_hash,
+                                     player, step, time_left)
+
+    @property
+    def round_trip(self):
+        return get_round_trip(self.proxy)
+
+    def close(self):
+        """Let the server forget this game."""
+        self.proxy.end_game(self.game_id)
+
+
+def connect_game_agent(uri, game_id=None):
+    """Connect to a remote player as connect_agent does, for the game
+    game_id (see GameAgentProxy) if not None.
+
+    Only XML-RPC agents take the game id: a binary protocol connection is
+    already served by its own copy of the agent for the whole game.
+
+    """
+    agent = connect_agent(uri)
+    if game_id is not None and \
+            not isinstance(agent, agent_protocol.BinaryAgentProxy):
+        agent = GameAgentProxy(agent, game_id)
+    return agent
+
+
+def is_agent_spec(agent):
+    """Return whether agent designates an agent class ("path.py:ClassName")
+    rather than the URI of an agent server."""
+    return "://" not in agent and ":" in agent
+
+
+def load_agent(spec, isolate=False):
+    """Return an agent for the class designated by "path.py:ClassName".
+
+    The agent runs in the game process, or in a dedicated child process
+    if isolate is True.
+
+    """
+    if isolate:
+        return ProcessAgent(spec)
+    return LocalAgent(profile_agent(load_agent_class(spec)()))
 
 
 if __name__ == "__main__":
@@ -344,15 +938,28 @@ if __name__ == "__main__":
         usage="%(prog)s [options] AGENT1 AGENT2\n" +
               "       %(prog)s [options] -r FILE")
     parser.add_argument("agent1", nargs='?', default='human',
-                        help="path to the first agent (Player 1) or" +
-                             " keyword 'human' (default: human)",
+                        help="path to the first agent (Player 1): URI of" +
+                             " an agent server, path.py:ClassName to load" +
+                             " it without a server, or keyword 'human'" +
+                             " (default: human)",
                         metavar="AGENT1")
     parser.add_argument("agent2", nargs='?', default='human',
-                        help="path to the second agent (Player 2) or" +
-                             " keyword 'human' (default: human)",
+                        help="path to the second agent (Player 2), as for" +
+                             " AGENT1 (default: human)",
                         metavar="AGENT2")
     parser.add_argument("-v", "--verbose", action="store_true", default=False,
                         help="be verbose")
+    parser.add_argument("--delta", action="store_true", default=False,
+                        help="send agents only the opponent's last action" +
+                             " instead of the full board")
+    parser.add_argument("--game-id",
+                        help="identify the game with GAME_ID for agents" +
+                             " served with --multi-game (unused by unix://" +
+                             " and tcp:// agents)",
+                        metavar="GAME_ID")
+    parser.add_argument("--isolate", action="store_true", default=False,
+                        help="run agents given as path.py:ClassName in a" +
+                             " child process instead of the game process")
     parser.add_argument("--no-gui",
                         action="store_false", dest="gui", default=True,
                         help="do not try to load the graphical user interface")
@@ -367,6 +974,16 @@ if __name__ == "__main__":
                         help="write the trace to FILE for replay with -r" +
                              " (no effect on replay)",
                         metavar="FILE")
+    parser.add_argument("--metrics", type=argparse.FileType('w'),
+                        help="write the latency breakdown of every agent" +
+                             " call to FILE as JSON lines, with a summary at" +
+                             " the end of the game",
+                        metavar="FILE")
+    parser.add_argument("--trace-format", choices=("binary", "pickle"),
+                        default="binary",
+                        help="format of the trace written with -w: binary," +
+                             " streamed during the game, or pickle, the" +
+                             " former format (default: %(default)s)")
     g = parser.add_argument_group("Rule options (no effect on replay)")
     g.add_argument("-t", "--time", type=posfloatarg,
                    help="set the time credit per player (default: untimed" +
@@ -400,7 +1017,8 @@ if __name__ == "__main__":
         try:
             trace = load_trace(args.replay)
             args.replay.close()
-        except (IOError, pickle.UnpicklingError) as e:
+        except (IOError, ValueError, struct.error,
+                pickle.UnpicklingError) as e:
             logging.error("Unable to load trace. Reason: %s", e)
             exit(1)
         board = trace.get_initial_board()
@@ -440,21 +1058,37 @@ if __name__ == "__main__":
         for i in range(2):
             if agents[i] == 'human':
                 agents[i] = viewer
+            elif is_agent_spec(agents[i]):
+                try:
+                    agents[i] = load_agent(agents[i], args.isolate)
+                except (ImportError, AttributeError, OSError) as e:
+                    parser.error("unable to load agent %s: %s" %
+                                 (agents[i], e))
+                credits[i] = args.time
             else:
-                agents[i] = connect_agent(agents[i])
+                agents[i] = connect_game_agent(
+                    agents[i], None if args.game_id is None
+                    else "%s:%d" % (args.game_id, i + 1))
                 credits[i] = args.time
 
-        game = Game(agents, board, viewer, credits)
+        game = Game(agents, board, viewer, credits, delta=args.delta,
+                    metrics=args.metrics)
+        if args.write is not None and args.trace_format == "binary":
+            game.trace.stream_to(args.write)
 
         def play():
             try:
                 game.startPlaying()
             except KeyboardInterrupt:
                 exit()
+            for agent in agents:
+                if isinstance(agent, GameAgentProxy):
+                    agent.close()
             if args.write is not None:
                 logging.info("Writing trace to '%s'", args.write.name)
                 try:
-                    game.trace.write(args.write)
+                    if args.trace_format == "pickle":
+                        game.trace.write_pickle(args.write)
                     args.write.close()
                 except IOError as e:
                     logging.error("Unable to write trace. Reason: %s", e)
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Columnar database of Avalam games.
+
+Many traces are ingested into a single file holding one numpy array per
+column: the moves of all games end to end, per game offsets, winners,
+reasons, time usage and agents, and every position of every game so that
+they can be scanned without replaying through Board.play_action. The file
+is memory-mapped when opened, and the columns are read-only views on it.
+
+File layout: the magic b"AVGS", a 4 bytes version and a 4 bytes header
+length, then a JSON header (dimensions, agent names and, for every column,
+its dtype, shape and offset), then the columns at 64 bytes aligned offsets.
+write_arrays and map_arrays implement it for the other position files as
+well (opening_book.py).
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from avalam import Board
+from game import TRACE_REASONS, load_trace, reason_code
+
+STORE_MAGIC = b"AVGS"
+STORE_VERSION = 1
+_PREAMBLE = struct.Struct(">4sII")
+_ALIGN = 64
+
+REASONS = TRACE_REASONS
+UNKNOWN_AGENT = "?"
+
+
+def apply_moves(initial, actions):
+    """Return the positions of a game as a (len(actions) + 1, rows, columns)
+    int8 array, starting with initial."""
+    positions = np.empty((len(actions) + 1,) + initial.shape, np.int8)
+    positions[0] = initial
+    m = initial.astype(np.int8)
+    for k, (i1, j1, i2, j2) in enumerate(actions):
+        h = abs(int(m[i1, j1])) + abs(int(m[i2, j2]))
+        m[i2, j2] = h if m[i1, j1] > 0 else -h
+        m[i1, j1] = 0
+        positions[k + 1] = m
+    return positions
+
+
+def write_arrays(path, magic, version, header, arrays):
+    """Write the dictionary header and the numpy arrays to path in the
+    store layout, the arrays being described in header["arrays"]."""
+    header = dict(header, arrays={})
+    # offsets depend on the header length, which depends on the offsets:
+    # lay the columns out after a header reserved with room to spare
+    reserved = len(json.dumps(header)) + 64 * (len(arrays) + 1)
+    offset = _PREAMBLE.size + reserved
+    for name, array in arrays.items():
+        offset = -(-offset // _ALIGN) * _ALIGN
+        header["arrays"][name] = [array.dtype.str, list(array.shape),
+                                  offset]
+        offset += array.nbytes
+    data = json.dumps(header).encode("utf-8")
+    assert len(data) <= reserved
+    with open(path, "wb") as f:
+        f.write(_PREAMBLE.pack(magic, version, len(data)))
+        f.write(data)
+        for name, array in arrays.items():
+            f.seek(header["arrays"][name][2])
+            f.write(np.ascontiguousarray(array).tobytes())
+
+
+def map_arrays(path, magic, version):
+    """Memory-map a file written by write_arrays.
+
+    Return (buf, header, arrays), arrays being a dictionary of read-only
+    views on the mmap buf. Raise ValueError if the magic or version differ.
+
+    """
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    found, found_version, n = _PREAMBLE.unpack_from(buf)
+    if found != magic or found_version != version:
+        buf.close()
+        raise ValueError("unexpected file format: %s" % path)
+    header = json.loads(buf[_PREAMBLE.size:_PREAMBLE.size + n])
+    arrays = {}
+    for name, (dtype, shape, offset) in header["arrays"].items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(buf, dtype, count,
+                                     offset).reshape(shape)
+    return buf, header, arrays
+
+
+def build_store(path, games):
+    """Write the store of games to path.
+
+    Arguments:
+    path -- file to write
+    games -- iterable of (trace, agents) where trace is a game.Trace (or
+        anything with the same attributes) and agents the names of Player 1
+        and Player 2, or None if unknown
+
+    Return the number of games written.
+
+    """
+    agent_ids = {}
+    lists = {name: [] for name in ("initial", "positions", "actions",
+                                   "players", "times", "offsets", "winner",
+                                   "reason", "time_limits", "time_used",
+                                   "agents")}
+    rows = n_columns = max_height = None
+    n_moves = 0
+    for trace, agents in games:
+        board = trace.initial_board
+        if rows is None:
+            rows, n_columns, max_height = board.rows, board.columns, \
+                board.max_height
+        elif (rows, n_columns) != (board.rows, board.columns):
+            raise ValueError("all games must be played on boards of the" +
+                             " same size")
+        initial = np.array(board.m, np.int8)
+        actions = [tuple(a) for p, a, t in trace.actions]
+        lists["initial"].append(initial)
+        lists["positions"].append(apply_moves(initial, actions))
+        lists["actions"].append(np.array(actions, np.int8).reshape(-1, 4))
+        lists["players"].append(np.array([p for p, a, t in trace.actions],
+                                         np.int8))
+        lists["times"].append(np.array([t for p, a, t in trace.actions],
+                                       np.float32))
+        lists["offsets"].append(n_moves)
+        n_moves += len(actions)
+        lists["winner"].append(trace.winner)
+        lists["reason"].append(reason_code(trace.reason))
+        lists["time_limits"].append([np.nan if t is None else t
+                                     for t in trace.time_limits])
+        lists["time_used"].append(
+            [sum(t for p, a, t in trace.actions if p == player)
+             for player in (1, -1)])
+        lists["agents"].append(
+            [agent_ids.setdefault(name, len(agent_ids))
+             for name in (agents or (UNKNOWN_AGENT, UNKNOWN_AGENT))])
+    n_games = len(lists["offsets"])
+    if n_games == 0:
+        raise ValueError("no game to store")
+    lists["offsets"].append(n_moves)
+    arrays = {
+        "initial": np.stack(lists["initial"]),
+        "positions": np.concatenate(lists["positions"]),
+        "actions": np.concatenate(lists["actions"]),
+        "players": np.concatenate(lists["players"]),
+        "times": np.concatenate(lists["times"]),
+        "offsets": np.array(lists["offsets"], np.int64),
+        "winner": np.array(lists["winner"], np.int16),
+        "reason": np.array(lists["reason"], np.uint8),
+        "time_limits": np.array(lists["time_limits"], np.float64),
+        "time_used": np.array(lists["time_used"], np.float32),
+        "agents": np.array(lists["agents"], np.int32),
+    }
+    header = {"rows": rows, "columns": n_columns, "max_height": max_height,
+              "agents": sorted(agent_ids, key=agent_ids.get)}
+    write_arrays(path, STORE_MAGIC, STORE_VERSION, header, arrays)
+    return n_games
+
+
+class GameStore:
+
+    """Read-only, memory-mapped view of a store written by build_store.
+
+    Attributes (numpy arrays, indexed by game unless stated otherwise):
+    offsets -- moves of game g are actions[offsets[g]:offsets[g + 1]]
+    actions, players, times -- per move: action, player and think time
+    positions -- per position: the board, the n + 1 positions of game g
+        starting at row offsets[g] + g
+    initial -- initial board
+    winner, reason -- result, reason being an index in REASONS
+    time_limits, time_used -- per player, time_limits NaN when untimed
+    agents -- per player, index in agent_names
+    length -- number of moves
+
+    """
+
+    def __init__(self, path):
+        try:
+            self.buf, header, arrays = map_arrays(path, STORE_MAGIC,
+                                                  STORE_VERSION)
+        except ValueError:
+            raise ValueError("not an Avalam game store: %s" % path)
+        self.rows = header["rows"]
+        self.columns = header["columns"]
+        self.max_height = header["max_height"]
+        self.agent_names = header["agents"]
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.length = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.winner)
+
+    def agent_id(self, name):
+        return self.agent_names.index(name)
+
+    def select(self, agent1=None, agent2=None, pair=None, result=None,
+               min_length=None, max_length=None, reason=None):
+        """Return the indices of the games matching all the given criteria.
+
+        Arguments:
+        agent1, agent2 -- name of the agent that played Player 1, Player 2
+        pair -- (name, name) of the two agents, whatever their colors
+        result -- 1, 0 or -1 for the games won by Player 1, drawn or won by
+            Player 2
+        min_length, max_length -- bounds on the number of moves
+        reason -- reason of the result, as in game.Trace
+
+        """
+        mask = np.ones(len(self), bool)
+        if agent1 is not None:
+            mask &= self.agents[:, 0] == self.agent_id(agent1)
+        if agent2 is not None:
+            mask &= self.agents[:, 1] == self.agent_id(agent2)
+        if pair is not None:
+            a, b = (self.agent_id(name) for name in pair)
+            mask &= ((self.agents[:, 0] == a) & (self.agents[:, 1] == b)) | \
+                    ((self.agents[:, 0] == b) & (self.agents[:, 1] == a))
+        if result is not None:
+            mask &= np.sign(self.winner) == result
+        if min_length is not None:
+            mask &= self.length >= min_length
+        if max_length is not None:
+            mask &= self.length <= max_length
+        if reason is not None:
+            mask &= self.reason == REASONS.index(reason)
+        return np.flatnonzero(mask)
+
+    def pairs(self):
+        """Return a dictionary mapping (agent1, agent2) names to the indices
+        of their games."""
+        keys = self.agents[:, 0].astype(np.int64) * len(self.agent_names) + \
+            self.agents[:, 1]
+        order = np.argsort(keys, kind="stable")
+        uniques, starts = np.unique(keys[order], return_index=True)
+        groups = np.split(order, starts[1:])
+        n = len(self.agent_names)
+        return {(self.agent_names[k // n], self.agent_names[k % n]): g
+                for k, g in zip(uniques.tolist(), groups)}
+
+    def moves(self, game):
+        """Return the (players, actions, times) arrays of game."""
+        s = slice(self.offsets[game], self.offsets[game + 1])
+        return self.players[s], self.actions[s], self.times[s]
+
+    def game_positions(self, game):
+        """Return the positions of game as a (length + 1, rows, columns)
+        array, the initial board first."""
+        start = self.offsets[game] + game
+        return self.positions[start:start + self.length[game] + 1] \
+            .reshape(-1, self.rows, self.columns)
+
+    def position_games(self):
+        """Return, for every row of positions, the index of its game and
+        its step (number of moves played before it)."""
+        games = np.repeat(np.arange(len(self)), self.length + 1)
+        starts = self.offsets[:-1] + np.arange(len(self))
+        steps = np.arange(len(self.positions)) - np.repeat(starts,
+                                                           self.length + 1)
+        return games, steps
+
+    def iter_positions(self, games=None):
+        """Yield (game, step, m, action) for every position of the games
+        (all by default), action being the move played from m or None for
+        the final position. m is a read-only (rows, columns) array."""
+        if games is None:
+            games = range(len(self))
+        for g in games:
+            positions = self.game_positions(g)
+            players, actions, times = self.moves(g)
+            for step in range(len(positions)):
+                action = tuple(actions[step].tolist()) \
+                    if step < len(actions) else None
+                yield g, step, positions[step], action
+
+    def get_board(self, game, step):
+        """Return the Board after step moves of game."""
+        m = self.game_positions(game)[step].tolist()
+        return Board(m, self.max_height)
+
+    def close(self):
+        for name in list(vars(self)):
+            if isinstance(getattr(self, name), np.ndarray):
+                delattr(self, name)
+        self.buf.close()
+
+
+def tournament_games(results, trace_dir):
+    """Yield the (trace, agents) of the games of a tournament.py results
+    file whose traces were written in trace_dir (--traces)."""
+    with open(results) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("type") != "game":
+                continue
+            path = os.path.join(trace_dir, "game_%05d.trace" % record["id"])
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as t:
+                yield load_trace(t), record["agents"]
+
+
+def trace_files(paths):
+    """Yield the (trace, None) of the trace files at paths."""
+    for path in paths:
+        with open(path, "rb") as f:
+            yield load_trace(f), None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("build", help="ingest traces into a store")
+    p.add_argument("store", help="store file to write")
+    p.add_argument("traces", nargs="*", metavar="TRACE",
+                   help="trace files of games with unknown agents")
+    p.add_argument("--tournament", nargs=2, metavar=("RESULTS", "DIR"),
+                   help="ingest the games of a tournament.py results file" +
+                        " whose traces are in DIR")
+    p = sub.add_parser("info", help="summarize a store")
+    p.add_argument("store", help="store file to read")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        def games():
+            if args.tournament is not None:
+                yield from tournament_games(*args.tournament)
+            yield from trace_files(args.traces)
+        n = build_store(args.store, games())
+        print("%d games written to %s" % (n, args.store))
+    else:
+        store = GameStore(args.store)
+        print("%d games, %d moves, %d positions" %
+              (len(store), len(store.actions), len(store.positions)))
+        print("%-60s %6s %6s %6s %6s %7s" % ("pair", "games", "p1", "draws",
+                                             "p2", "length"))
+        for (a, b), games in sorted(store.pairs().items()):
+            results = np.sign(store.winner[games])
+            print("%-60s %6d %6d %6d %6d %7.1f" %
+                  ("%s vs %s" % (a, b), len(games), (results > 0).sum(),
+                   (results == 0).sum(), (results < 0).sum(),
+                   store.length[games].mean()))
+        for code, reason in enumerate(REASONS):
+            n = (store.reason == code).sum()
+            if code and n:
+                print("%d games: %s" % (n, reason))
@@ -26,7 +26,7 @@ import time
 import threading
 from SimpleWebSocketServer import WebSocket, SimpleWebSocketServer, SimpleSSLWebSocketServer
 from optparse import OptionParser
-from game import Viewer, Game
+from game import Viewer, Game, ReplayBoards
 
 logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
 
@@ -234,16 +234,11 @@ class WebViewer(Viewer):
     """
     self.trace = trace
     self.speed = speed
-    # generate all boards to access them backwards
-    self.boards = [trace.get_initial_board()]
-    for step in range(len(trace.actions)):
-      player, action, t = trace.actions[step]
-      b = self.boards[-1].clone()
-      b.play_action(action)
-      self.boards.append(b)
+    # boards to access them backwards, rebuilt from checkpoints on demand
+    self.boards = ReplayBoards(trace)
     self.step = 0
     self.server.initialize_replay(self.trace, self.speed, self.boards)
-    self.init_viewer(self.boards[0], None)
+    self.init_viewer(trace.get_initial_board(), None)
 
   def close_sig_handler(self, signal, frame):
     self.server.close()
@@ -277,7 +272,8 @@ class WebViewer(Viewer):
       print("Player 1" if winner > 0 else "Player 2", "has won!")
     if reason:
       print("Reason:", reason)
-    self.server.initialize_replay(self.game.trace, 1.0, [])
+    self.server.initialize_replay(self.game.trace, 1.0,
+                                  ReplayBoards(self.game.trace))
     self.server.finished(steps, winner, reason)
 
 
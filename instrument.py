@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Hot-path counters and per-move profiles for the Avalam boards and agents.
+
+Counting is enabled by setting the AVALAM_COUNTERS environment variable to
+a non-empty value before the boards are imported: Board.clone,
+Board.play_action, Board.get_actions and Board.is_action_valid (and their
+overrides in the subclasses given to instrument) are then replaced by
+wrappers counting their calls and the time spent in them. Times are
+inclusive: get_actions includes the is_action_valid calls it makes. When
+the variable is not set, instrument leaves the classes untouched and the
+plain methods run without any overhead.
+
+Setting AVALAM_PROFILE to a directory runs every Agent.play call under
+cProfile and dumps one profile per move there, named
+<agent>-<pid>-<step>.prof (read them with python -m pstats). agent_main
+does the same with --profile DIR.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import cProfile
+import functools
+import inspect
+import os
+import threading
+import time
+
+ENABLED = bool(os.environ.get("AVALAM_COUNTERS"))
+PROFILE_DIR = os.environ.get("AVALAM_PROFILE") or None
+
+HOT_METHODS = ("clone", "play_action", "get_actions", "is_action_valid")
+
+# method name -> [calls, seconds], shared by a class and its subclasses
+counters = {}
+# names of the counted methods running in the current thread: an override
+# calling the method it overrides through super() is counted once
+_running = threading.local()
+
+
+def _counted(name, fn):
+    counter = counters.setdefault(name, [0, 0.0])
+    clock = time.perf_counter
+
+    if inspect.isgeneratorfunction(fn):
+        # only the time spent producing the items is counted, not the time
+        # the caller spends between them
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            counter[0] += 1
+            start = clock()
+            it = fn(*args, **kwargs)
+            while True:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    counter[1] += clock() - start
+                    return
+                counter[1] += clock() - start
+                yield item
+                start = clock()
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            running = _running.__dict__.setdefault("names", set())
+            if name in running:
+                return fn(*args, **kwargs)
+            running.add(name)
+            counter[0] += 1
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                counter[1] += clock() - start
+                running.discard(name)
+    wrapper.__wrapped_counted__ = True
+    return wrapper
+
+
+def instrument(cls, methods=HOT_METHODS):
+    """Wrap the methods of cls with counters if counting is enabled.
+
+    Only the methods defined by cls itself are wrapped, those it inherits
+    are counted through the class defining them. Return cls, so that this
+    can be used as a class decorator.
+
+    """
+    if not ENABLED:
+        return cls
+    for name in methods:
+        fn = cls.__dict__.get(name)
+        if fn is not None and not hasattr(fn, "__wrapped_counted__"):
+            setattr(cls, name, _counted(name, fn))
+    return cls
+
+
+def snapshot():
+    """Return a copy of the counters."""
+    return {name: tuple(c) for name, c in counters.items()}
+
+
+def delta(before):
+    """Return the counters as {name: (calls, seconds)} accumulated since
+    the snapshot before."""
+    return {name: (c[0] - before.get(name, (0, 0.0))[0],
+                   c[1] - before.get(name, (0, 0.0))[1])
+            for name, c in counters.items()}
+
+
+def format_counters(counts):
+    """Return counts, as returned by delta, on one line."""
+    return ", ".join("%s %d (%.1fms)" % (name, calls, seconds * 1000)
+                     for name, (calls, seconds) in sorted(counts.items())
+                     if calls)
+
+
+def profile_agent(agent, directory=None):
+    """Run the play method of agent under cProfile, dumping one profile per
+    move in directory (default: AVALAM_PROFILE). Return agent."""
+    directory = directory or PROFILE_DIR
+    if directory is None:
+        return agent
+    os.makedirs(directory, exist_ok=True)
+    cls = type(agent)
+
+    def play(self, percepts, player, step, time_left):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(super(profiled, self).play, percepts,
+                                   player, step, time_left)
+        finally:
+            # the pid tells apart the workers of a multi-game server
+            profile.dump_stats(os.path.join(directory, "%s-%d-%03d.prof" %
+                                            (cls.__name__, os.getpid(),
+                                             step)))
+    # a subclass rather than an instance attribute, so that the copies made
+    # by avalam.serve_agent_multi are profiled as well
+    profiled = type(cls.__name__, (cls,), {"play": play,
+                                           "__module__": cls.__module__})
+    agent.__class__ = profiled
+    return agent
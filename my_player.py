@@ -18,12 +18,22 @@ along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 """
 from avalam import *
-from custom_board import CustomBoard, dict_to_board_custom
+from custom_board import (ActiveCellBoard, CustomBoard, batch_scores,
+                          dict_to_board_active)
 from time import time
 from datetime import datetime
 import traceback
+import numpy as np
+import instrument
+from eval_cache import EvalCache
 
 LOGING_ACTIVATED = False
+# bound-based cutoffs are only tried below this number of active towers,
+# they never cut anything higher up in the game
+BOUNDS_MAX_ACTIVE = 20
+# below this number of children, the batch evaluation of the last ply costs
+# more than evaluating them one by one
+FRONTIER_MIN_CHILDREN = 12
 
 
 #logging
@@ -48,22 +58,73 @@ except:
         
 class MinmaxAlphaBetaIterativeDepth:
         
-    def __init__(self) -> None:
+    def __init__(self, tablebase=None, prune_bounds=True, eval_cache=None,
+                 frontier=True) -> None:
         self.start_time = None
         self.remaining_time = None
         self.max_depth_reached = False
         self.first_run = True
         self.logger = logger 
+        self.tablebase = tablebase
+        self.prune_bounds = prune_bounds
+        self.eval_cache = eval_cache
+        # the leaves are evaluated in a batch, unless the tablebase may
+        # give them their exact value
+        self.frontier = frontier and tablebase is None
     
     def was_max_depth_reached(self) -> bool:
         return self.max_depth_reached
     
     def get_heuristique(self, board: CustomBoard):
+        if self.eval_cache is not None:
+            return self.eval_cache.evaluate(board, self.heuristique)
         return self.heuristique(board)
     
     def heuristique(self, board: CustomBoard):
         score, score_mouvement_tower, score_max_height = board.get_scores()
         return score + 0.2 * score_mouvement_tower + 0.5 * score_max_height
+
+    def get_leaf_value(self, board: CustomBoard, player: int):
+        if self.tablebase is not None:
+            value = self.tablebase.probe(board, player)
+            if value is not None:
+                # heuristique of the final board: all its towers are frozen
+                score, score_max_height = value
+                return score + 0.2 * (score - score_max_height) + 0.5 * score_max_height
+        return self.get_heuristique(board)
+
+    def get_bounds(self, board: ActiveCellBoard, depth: int):
+        """Return (lower, upper) bounds of the value of a search of board to depth.
+
+        The tower count score moves by one per move, at most
+        board.get_moves_left_bound() times. The active towers add at most
+        0.2 each to the heuristique once frozen, 0.5 for the ones reaching
+        the maximal height, which takes a move each, and every move removes
+        one of them.
+        """
+        moves = board.get_moves_left_bound()
+        if self.tablebase is None:
+            # the leaves are evaluated as they are, depth moves ahead
+            moves = min(moves, depth)
+        left = len(board.active) - moves
+        value = self.get_heuristique(board)
+        margin = moves + 0.2 * left + 0.3 * min(moves, left)
+        return value - margin, value + margin
+
+    def evaluate_children(self, board: CustomBoard, actions: list):
+        """Return the heuristique of the children of board by actions as an
+        array, computed at once by batch_scores."""
+        score, score_mouvement_tower, score_max_height, finished = \
+            batch_scores(board, actions)
+        if finished.any():
+            self.max_depth_reached = True
+        return score + 0.2 * score_mouvement_tower + 0.5 * score_max_height
+
+    def is_decided(self, board: ActiveCellBoard) -> bool:
+        """Return whether the winner is known whatever the moves left."""
+        score = board.get_scores()[0]
+        moves = board.get_moves_left_bound()
+        return score - moves > 0 or score + moves < 0
     
 
     def apply_min(self, depth, board: CustomBoard, alpha: float, beta: float):
@@ -73,10 +134,24 @@ class MinmaxAlphaBetaIterativeDepth:
             self.max_depth_reached = True
             return self.get_heuristique(board), None
         if depth == 0:
-            return self.get_heuristique(board), None
+            return self.get_leaf_value(board, PLAYER2), None
+        if self.prune_bounds and isinstance(board, ActiveCellBoard) and \
+                len(board.active) <= BOUNDS_MAX_ACTIVE:
+            lower, upper = self.get_bounds(board, depth)
+            if upper <= alpha:
+                return upper, None
+            if lower >= beta:
+                return lower, None
+        actions = board.get_actions()
+        if depth == 1 and self.frontier:
+            actions = list(actions)
+            if len(actions) >= FRONTIER_MIN_CHILDREN:
+                values = self.evaluate_children(board, actions)
+                k = int(np.argmin(values))
+                return float(values[k]), actions[k]
         minEval = float('inf')
         best_action = None
-        for action in board.get_actions():
+        for action in actions:
             new_board = board.clone()
             new_board.play_action(action)
             evaluation = self.apply_max(depth - 1, new_board, alpha, beta)[0]
@@ -97,10 +172,24 @@ class MinmaxAlphaBetaIterativeDepth:
             self.max_depth_reached = True
             return self.get_heuristique(board), None
         if depth == 0:
-            return self.get_heuristique(board), None
+            return self.get_leaf_value(board, PLAYER1), None
+        if self.prune_bounds and isinstance(board, ActiveCellBoard) and \
+                len(board.active) <= BOUNDS_MAX_ACTIVE:
+            lower, upper = self.get_bounds(board, depth)
+            if upper <= alpha:
+                return upper, None
+            if lower >= beta:
+                return lower, None
+        actions = board.get_actions()
+        if depth == 1 and self.frontier:
+            actions = list(actions)
+            if len(actions) >= FRONTIER_MIN_CHILDREN:
+                values = self.evaluate_children(board, actions)
+                k = int(np.argmax(values))
+                return float(values[k]), actions[k]
         maxEval = float('-inf')
         best_action = None
-        for action in board.get_actions():
+        for action in actions:
             new_board = board.clone()
             new_board.play_action(action)
             evaluation = self.apply_min(depth - 1, new_board, alpha, beta)[0]
@@ -167,11 +256,15 @@ class MyAgent(Agent):
 
     """My Avalam agent."""
         
-    def __init__(self) -> None:
+    def __init__(self, book=None, tablebase=None, eval_cache=None) -> None:
         super().__init__()
         self.usual_time = None
         self.round = 0
         self.logger = logger
+        self.book = book
+        self.tablebase = tablebase
+        # kept from move to move, positions recur across them
+        self.eval_cache = eval_cache
 
     def play(self, percepts: dict, player: int, step, time_left: float):
         """
@@ -192,18 +285,35 @@ class MyAgent(Agent):
             self.round += 1
             self.logger.info(f"Play of the bot: {self.round}")
             start = time()
+            counters = instrument.snapshot()
             if self.usual_time is None:
                 self.usual_time = time_left / 20
 
             self.logger.info(f"Time left for move: {time_left}")
-            board: CustomBoard = dict_to_board_custom(percepts)
-            algorithm = MinmaxAlphaBetaIterativeDepth()
+            board: CustomBoard = dict_to_board_active(percepts)
+            if self.book is not None:
+                entry = self.book.probe(board)
+                if entry is not None:
+                    self.logger.info(f"Book move: {entry[0]} (score {entry[1]})\n")
+                    return entry[0]
+            if self.tablebase is not None:
+                entry = self.tablebase.best_action(board, player)
+                if entry is not None:
+                    self.logger.info(f"Tablebase move: {entry[0]} (outcome {entry[1]})\n")
+                    return entry[0]
+            algorithm = MinmaxAlphaBetaIterativeDepth(self.tablebase, eval_cache=self.eval_cache)
+            if self.eval_cache is not None:
+                cache_stats = self.eval_cache.stats()
             
             max_player = False
             if player == 1:
                 max_player = True
             
-            if self.usual_time > time_left:
+            if algorithm.is_decided(board):
+                # nothing left to search for: any move keeps the result
+                self.logger.info("Game already decided")
+                best_action = algorithm._try_minmax(1, float('inf'), max_player, board)
+            elif self.usual_time > time_left:
                 if time_left >= self.usual_time * 2/3:
                     best_action = algorithm.run_minimax(2, time_left * 2/9, max_player, board)
                 elif time_left >= self.usual_time * 4/9:
@@ -218,11 +328,49 @@ class MyAgent(Agent):
             
             self.logger.info(f"Time to select move: {time() - start}")
             self.logger.info(f"Total Time left after move: {time_left - (time() - start)}")
+            if self.eval_cache is not None:
+                self.logger.info(f"Evaluation cache: {self.eval_cache.hits - cache_stats['hits']} hits, "
+                                 f"{self.eval_cache.misses - cache_stats['misses']} misses, "
+                                 f"{len(self.eval_cache)} entries")
+            if instrument.ENABLED:
+                self.logger.info("Hot path: " + instrument.format_counters(
+                    instrument.delta(counters)))
             self.logger.info(f"Move chosen: {best_action}\n")
             return best_action
         except:
             self.logger.info(traceback.format_exc())
 
 
+def add_arguments(agent, parser):
+    parser.add_argument("--book", metavar="FILE",
+                        help="play the moves of the opening book FILE" +
+                             " (see opening_book.py) while in book")
+    parser.add_argument("--tablebase", metavar="FILE",
+                        help="evaluate the leaves and play the endgames with" +
+                             " the exact results of the tablebase FILE (see" +
+                             " tablebase.py)")
+    parser.add_argument("--regions", type=int, metavar="N",
+                        help="solve exactly the positions of up to N" +
+                             " interacting towers, split into independent" +
+                             " groups (see regions.py)")
+    parser.add_argument("--eval-cache", type=int, default=0, metavar="N",
+                        help="cache the evaluations of the last N positions" +
+                             " (default: disabled)")
+
+
+def setup(agent, parser, args):
+    if args.book is not None:
+        from opening_book import OpeningBook
+        agent.book = OpeningBook(args.book)
+    if args.tablebase is not None:
+        from tablebase import Tablebase
+        agent.tablebase = Tablebase(args.tablebase)
+    if args.regions is not None:
+        from regions import RegionSolver
+        agent.tablebase = RegionSolver(agent.tablebase, args.regions)
+    if args.eval_cache > 0:
+        agent.eval_cache = EvalCache(args.eval_cache)
+
+
 if __name__ == "__main__":
-    agent_main(MyAgent())
\ No newline at end of file
+    agent_main(MyAgent(), add_arguments, setup)
\ No newline at end of file
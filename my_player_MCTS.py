@@ -19,8 +19,11 @@ along with this program; if not, see <http://www.gnu.org/licenses/>.
 """
 import math
 import random
+import time
+import multiprocessing
 from typing import List, Tuple
 from avalam import *
+from custom_board import ActiveCellBoard, dict_to_board_active
 import numpy as np
 import sys
 
@@ -34,6 +37,12 @@ handler = logging.FileHandler(filename=file, encoding="utf-8", mode="w")
 handler.setFormatter(logging.Formatter('%(asctime)s:%(message)s'))
 logger.addHandler(handler)
 
+def expired(deadline) -> bool:
+    """Returns whether the wall-clock time deadline (time.time(), None for no
+    deadline) is past. Wall-clock time is shared by the worker processes."""
+    return deadline is not None and time.time() >= deadline
+
+
 def rollout_policy(possible_moves, current_board: Board, player: int):
     # TOOOOOOOOOO SLOW      :(
     if player == 1:
@@ -58,17 +67,117 @@ def rollout_policy(possible_moves, current_board: Board, player: int):
         return random.choice(possible_moves)
     return selected_move
 
+def action_key(action) -> int:
+    """Returns the integer encoding of an action (i1, j1, i2, j2) of a 9x9 board."""
+    i1, j1, i2, j2 = action
+    return ((i1 * 9 + j1) * 9 + i2) * 9 + j2
+
+def move_key(board: Board, action) -> int:
+    """
+    Returns the AMAF key of playing action on board: the action key and the
+    color of the moved tower, which decides the color of the resulting tower.
+    """
+    return action_key(action) * 2 + (board.m[action[0]][action[1]] > 0)
+
+def simulate(board: Board, player: int, moves=None, to_move=None):
+    """
+    Play random moves on board until the game is over and return the
+    result from the point of view of player. The board is modified in place.
+    If moves is a list, the move_key of the played actions are appended to it.
+    If to_move, the player to move on board, is given and a tablebase is set,
+    the playout stops with the exact result as soon as the tablebase has it.
+    """
+    tablebase = MonteCarloTreeSearchNode.tablebase
+    if to_move is None:
+        tablebase = None
+    while True:
+        if tablebase is not None:
+            score = tablebase.probe_score(board, to_move)
+            if score is not None:
+                return score if player > 0 else -score
+        possible_moves = list(board.get_actions())
+        if len(possible_moves) == 0:
+            break
+        action = random.choice(possible_moves)
+        if moves is not None:
+            moves.append(move_key(board, action))
+        board.play_action(action)
+        if to_move is not None:
+            to_move = -to_move
+    score = board.get_score()
+    return score if player > 0 else -score
+
+class NodePool():
+    """
+    Keeps count of the nodes of a search tree and recycles the nodes
+    released by MonteCarloTreeSearchNode.prune. Their boards are not reused:
+    a board may hold more than its cells (the active cells and hash of an
+    ActiveCellBoard), so every node gets a clone of its parent's. With
+    max_nodes set, the search prunes its tree whenever the pool is full.
+    """
+
+    def __init__(self, max_nodes=None):
+        self.max_nodes = max_nodes
+        self.size = 0
+        self.free = []
+
+    def is_full(self) -> bool:
+        return self.max_nodes is not None and self.size >= self.max_nodes
+
+    def acquire(self, parent, action):
+        """Returns a node for the state reached by playing action from parent."""
+        if self.free:
+            node = self.free.pop()
+        else:
+            node = MonteCarloTreeSearchNode.__new__(MonteCarloTreeSearchNode)
+        board = parent.state.clone()
+        board.play_action(action)
+        node.__init__(board, parent=parent, parent_action=action)
+        return node
+
+    def release(self, node):
+        """Gives back node and its whole subtree."""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children)
+            node.children = []
+            node.parent = None
+            self.size -= 1
+            self.free.append(node)
+
+
 class MonteCarloTreeSearchNode():
     player_number = 1
+    # RAVE equivalence parameter: number of visits at which the node and AMAF
+    # statistics weigh the same. None disables RAVE.
+    rave_k = None
+    # tablebase.Tablebase giving the exact result of the endgames, or None
+    tablebase = None
+    # eval_cache.EvalCache of the results of the terminal positions, or None
+    eval_cache = None
     
-    def __init__(self, board: Board, parent=None, parent_action=None):
+    def __init__(self, board: Board, parent=None, parent_action=None, pool: NodePool = None):
         self.state: Board = board
         self.parent: MonteCarloTreeSearchNode = parent
         self.parent_action = parent_action
+        if pool is None:
+            pool = parent.pool if parent is not None else NodePool()
+        self.pool = pool
+        pool.size += 1
         self.children: List[MonteCarloTreeSearchNode] = []
         self._number_of_visits = 0
         self.points = 0
+        # player to move in this state
+        self.player = -parent.player if parent is not None else MonteCarloTreeSearchNode.player_number
+        # exact result once the subtree is solved, None while it is not
+        self.proven = None
+        # all-moves-as-first statistics of the moves of the player to move:
+        # move_key -> [visits, points]
+        self.amaf = {}
         self.untried_actions()
+        if self.is_terminal_node():
+            self.proven = self.game_result()
         
     def rollout_policy_random(self, possible_moves):
         return random.choice(possible_moves)
@@ -107,7 +216,7 @@ class MonteCarloTreeSearchNode():
         """
         This is used to check if the current node is terminal or not. Terminal node is reached when the game is over.
         """
-        return self.state.is_finished()
+        return not self._untried_actions and not self.children
     
     def rollout(self):
         """
@@ -116,19 +225,37 @@ class MonteCarloTreeSearchNode():
         Otherwise it is -1 if it results in a loss. And it is 0 if it is a tie. If the entire game is randomly simulated,
         that is at each turn the move is randomly selected out of set of possible moves, it is called light playout.
         """
-        current_rollout_state = self
-        
-        while not current_rollout_state.is_game_over():
-            
-            possible_moves = current_rollout_state.get_legal_actions()
-            if len(possible_moves) == 0 :
-                break
-            action = self.rollout_policy_random(possible_moves)
-            # action = rollout_policy(possible_moves, current_rollout_state.state, MonteCarloTreeSearchNode.player_number)
-            
-            current_rollout_state = current_rollout_state.move(action)
-            
-        return current_rollout_state.game_result()
+        return simulate(self.state.clone(), MonteCarloTreeSearchNode.player_number,
+                        to_move=self.player)
+
+    def rollout_moves(self):
+        """Same as rollout but also returns the move_key of the actions played."""
+        moves = []
+        return simulate(self.state.clone(), MonteCarloTreeSearchNode.player_number, moves,
+                        self.player), moves
+
+    def backpropagate_amaf(self, result: int, moves: List[int]):
+        """
+        Update the AMAF statistics of the nodes on the path from the root to
+        this node. Each node credits the first occurrence of every move its
+        player to move made later in the simulation, whether in the tree or
+        in the rollout.
+        """
+        node = self
+        while node.parent is not None:
+            moves = [move_key(node.parent.state, node.parent_action)] + moves
+            node = node.parent
+            seen = set()
+            for key in moves[::2]:
+                if key in seen:
+                    continue
+                seen.add(key)
+                stats = node.amaf.get(key)
+                if stats is None:
+                    node.amaf[key] = [1, result]
+                else:
+                    stats[0] += 1
+                    stats[1] += result
     
     def backpropagate(self, result: int):
         """
@@ -137,10 +264,35 @@ class MonteCarloTreeSearchNode():
         If the result is 1, that is it resulted in a win, then the win is incremented by 1. 
         Otherwise if result is a loss, then loss is incremented by 1.
         """
-        self._number_of_visits += 1.
-        self.points += result
-        if self.parent is not None:
-            self.parent.backpropagate(result)
+        node = self
+        while node is not None:
+            node._number_of_visits += 1.
+            node.points += result
+            node = node.parent
+
+    def is_max_node(self) -> bool:
+        """Returns whether the player to move is the one the search plays for."""
+        return self.player == MonteCarloTreeSearchNode.player_number
+
+    def update_proven(self):
+        """
+        MCTS-Solver propagation: a node is proven as soon as the player to move
+        has a proven winning child, or once all its children are proven. Walk
+        up the tree while nodes get proven.
+        """
+        node = self
+        while node is not None:
+            if node.proven is None:
+                sign = 1 if node.is_max_node() else -1
+                proven = [c.proven for c in node.children if c.proven is not None]
+                winning = [p for p in proven if sign * p > 0]
+                if winning:
+                    node.proven = sign * max(sign * p for p in winning)
+                elif node.is_fully_expanded() and len(proven) == len(node.children):
+                    node.proven = sign * max(sign * p for p in proven)
+                else:
+                    return
+            node = node.parent
             
     def is_fully_expanded(self):
         """
@@ -154,15 +306,32 @@ class MonteCarloTreeSearchNode():
         Once fully expanded, this function selects the best child out of the children array. 
         The first term in the formula corresponds to exploitation and the second term corresponds to exploration.
         """
-        choices_weights = [(c.q() / c.n()) + c_param * math.sqrt((2 * math.log(self.n()) / c.n())) for c in self.children]
-        return self.children[np.argmax(choices_weights)]
+        sign = 1 if self.is_max_node() else -1
+        children = [c for c in self.children if c.proven is None]
+        choices_weights = [sign * self.child_value(c) + c_param * math.sqrt((2 * math.log(self.n()) / c.n())) for c in children]
+        return children[np.argmax(choices_weights)]
+
+    def child_value(self, c) -> float:
+        """
+        Average result of child c, blended with the AMAF average of its move
+        when RAVE is enabled. The AMAF weight decays as c gets visited.
+        """
+        value = c.q() / c.n()
+        k = MonteCarloTreeSearchNode.rave_k
+        if k is None:
+            return value
+        stats = self.amaf.get(move_key(self.state, c.parent_action))
+        if stats is None:
+            return value
+        beta = math.sqrt(k / (3 * c.n() + k))
+        return (1 - beta) * value + beta * stats[1] / stats[0]
     
     def _tree_policy(self):
         """
         Selects node to run rollout.
         """
         current_node = self
-        while not current_node.is_terminal_node():
+        while current_node.proven is None:
             
             if not current_node.is_fully_expanded():
                 return current_node.expand()
@@ -178,26 +347,142 @@ class MonteCarloTreeSearchNode():
         '''
         return list(self.state.get_actions())
     
-    def best_action(self):
+    def best_action(self, simulation_no=1000, deadline=None):
         """
         This is the best action function which returns the node corresponding to best possible move. 
         The step of expansion, simulation and backpropagation are carried out by the code above.
         """
-        simulation_no = 1000
-        
-        
+        self.search(simulation_no, deadline)
+        return self.final_child()
+
+    def final_child(self):
+        """
+        Returns the child to play after the search: proven wins first, proven
+        losses last, ties broken by exact result for proven children and by
+        child_value for the others.
+        """
+        sign = 1 if self.is_max_node() else -1
+        def value(c):
+            if c.proven is not None:
+                return (sign * c.proven > 0) - (sign * c.proven < 0), sign * c.proven
+            return 0, sign * self.child_value(c)
+        return max(self.children, key=value)
+
+    def search(self, simulation_no, deadline=None):
+        """
+        Run simulation_no iterations of selection, rollout and backpropagation.
+        Stop early once the root is proven or, after the first iteration, the
+        deadline is past.
+        """
         for i in range(simulation_no):
+            if self.proven is not None or i and expired(deadline):
+                break
+            if self.pool.is_full():
+                self.prune()
             v = self._tree_policy()
-            reward = v.rollout()
-            v.backpropagate(reward)
-        
-        return self.best_child()
+            if v.proven is not None:
+                reward = v.proven
+                v.backpropagate(reward)
+                v.update_proven()
+            elif MonteCarloTreeSearchNode.rave_k is not None:
+                reward, moves = v.rollout_moves()
+                v.backpropagate(reward)
+                v.backpropagate_amaf(reward, moves)
+            else:
+                v.backpropagate(v.rollout())
+
+    def prune(self, keep=0.75):
+        """
+        Release the least visited subtrees until the tree holds at most keep
+        times the node budget. A pruned child keeps its contribution in the
+        statistics of its parent and its action goes back to the untried
+        actions, so it can be expanded again later.
+        """
+        nodes = []
+        stack = list(self.children)
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.children)
+        nodes.sort(key=lambda c: c.n())
+        target = keep * self.pool.max_nodes
+        for node in nodes:
+            if self.pool.size <= target:
+                break
+            parent = node.parent
+            if parent is None:
+                # already released with an ancestor
+                continue
+            parent.children.remove(node)
+            parent._untried_actions.insert(0, node.parent_action)
+            self.pool.release(node)
+
+    def add_virtual_loss(self, loss=1):
+        """
+        Pretend a pending simulation through this node was lost so that other
+        selections of the same batch are steered elsewhere.
+        """
+        node = self
+        while node.parent is not None:
+            node._number_of_visits += 1.
+            node.points -= loss if node.parent.is_max_node() else -loss
+            node = node.parent
+        node._number_of_visits += 1.
+
+    def remove_virtual_loss(self, loss=1):
+        """Undo add_virtual_loss once the real result is known."""
+        node = self
+        while node.parent is not None:
+            node._number_of_visits -= 1.
+            node.points += loss if node.parent.is_max_node() else -loss
+            node = node.parent
+        node._number_of_visits -= 1.
+
+    def leaf_parallel_search(self, simulation_no, pool, workers, deadline=None):
+        """
+        Run simulation_no iterations, selecting batches of workers leaves
+        with virtual loss and running their rollouts in pool, until the
+        deadline is past.
+        """
+        done = 0
+        while done < simulation_no and self.proven is None and \
+                not (done and expired(deadline)):
+            if self.pool.is_full():
+                self.prune()
+            leaves = []
+            for _ in range(min(workers, simulation_no - done)):
+                v = self._tree_policy()
+                if v.proven is not None:
+                    v.backpropagate(v.proven)
+                    v.update_proven()
+                    done += 1
+                    if self.proven is not None:
+                        break
+                    continue
+                v.add_virtual_loss()
+                leaves.append(v)
+            results = pool.map(_rollout_worker,
+                               [(v.state.m, MonteCarloTreeSearchNode.player_number, v.player,
+                                 random.getrandbits(32))
+                                for v in leaves])
+            for v, (reward, moves) in zip(leaves, results):
+                v.remove_virtual_loss()
+                v.backpropagate(reward)
+                if MonteCarloTreeSearchNode.rave_k is not None:
+                    v.backpropagate_amaf(reward, moves)
+            done += len(leaves)
+
+    def most_visited_child(self):
+        """Returns the child with the largest visit count."""
+        if self.proven is not None:
+            return self.final_child()
+        return max(self.children, key=lambda c: c.n())
     
     def is_game_over(self):
         '''
             return if game over in that state
         '''
-        self.state.is_finished()
+        return self.state.is_finished()
     
     def move(self, action):
         '''
@@ -213,9 +498,7 @@ class MonteCarloTreeSearchNode():
         represents that x is placed. Returns 
         the new state after making a move.
         '''
-        new_board = self.state.clone()
-        new_board.play_action(action)
-        return MonteCarloTreeSearchNode(new_board, parent=self, parent_action=action)
+        return self.pool.acquire(self, action)
     
     def game_result(self):
         """
@@ -224,7 +507,11 @@ class MonteCarloTreeSearchNode():
         on your state corresponding to win,
         tie or a loss.
         """
-        score = self.state.get_score()
+        if MonteCarloTreeSearchNode.eval_cache is not None:
+            score = MonteCarloTreeSearchNode.eval_cache.evaluate(
+                self.state, lambda board: board.get_score())
+        else:
+            score = self.state.get_score()
         if score == 0:
             return 0
         
@@ -235,12 +522,239 @@ class MonteCarloTreeSearchNode():
         
     def __eq__(self, other):
         return self.state.m == other.state.m
-        
+
+    def count_nodes(self) -> int:
+        """Returns the number of nodes in the subtree rooted at this node."""
+        count = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children)
+        return count
+
+    def root_stats(self):
+        """Returns the statistics of the children as (action, visits, points, proven) tuples."""
+        return [(c.parent_action, c.n(), c.q(), c.proven) for c in self.children]
+
+
+class GraphEdge():
+    """Move between two positions of a MonteCarloGraphSearch, with its own statistics."""
+
+    def __init__(self, action, child):
+        self.action = action
+        self.child: GraphNode = child
+        self.visits = 0
+        self.points = 0
+
+
+class GraphNode():
+    """Position of a MonteCarloGraphSearch, shared by all the move orders reaching it."""
+
+    def __init__(self, board: Board, player: int):
+        self.state: Board = board
+        self.player = player
+        self.edges: List[GraphEdge] = []
+        self.visits = 0
+        self.points = 0
+        self.untried_actions: List[Tuple] = list(board.get_actions())
+
+    def is_terminal_node(self) -> bool:
+        return not self.edges and not self.untried_actions
+
+
+class MonteCarloGraphSearch():
+    """
+    Transposition-aware variant of MonteCarloTreeSearchNode. Positions are
+    stored in a table keyed by their Zobrist hash so that the same position
+    reached through different move orders shares its statistics. Selection
+    uses the value of the (shared) child position and the visit count of
+    the edge leading to it.
+    """
+
+    def __init__(self, board: Board):
+        self.table = {}
+        self.root = self.get_node(board, MonteCarloTreeSearchNode.player_number)
+
+    def get_node(self, board: Board, player: int) -> GraphNode:
+        """
+        Returns the node of board, creating it if the position is new. Every
+        move removes one tower, so a position is always reached with the same
+        player to move.
+        """
+        key = board.get_hash()
+        node = self.table.get(key)
+        if node is None:
+            node = GraphNode(board, player)
+            self.table[key] = node
+        return node
+
+    def count_nodes(self) -> int:
+        """Returns the number of unique positions stored."""
+        return len(self.table)
+
+    def best_edge(self, node: GraphNode, c_param=1.41) -> GraphEdge:
+        """UCT on edges: exploitation from the child position, exploration from the edge."""
+        log_n = math.log(node.visits)
+        sign = 1 if node.player == MonteCarloTreeSearchNode.player_number else -1
+        choices_weights = [sign * (e.child.points / e.child.visits if e.child.visits else 0)
+                           + c_param * math.sqrt(2 * log_n / e.visits) for e in node.edges]
+        return node.edges[np.argmax(choices_weights)]
+
+    def _tree_policy(self):
+        """Selects the path of edges leading to the position to run the rollout from."""
+        node = self.root
+        path = []
+        while not node.is_terminal_node():
+            if node.untried_actions:
+                action = node.untried_actions.pop()
+                board = node.state.clone()
+                board.play_action(action)
+                edge = GraphEdge(action, self.get_node(board, -node.player))
+                node.edges.append(edge)
+                path.append(edge)
+                return path
+            edge = self.best_edge(node)
+            path.append(edge)
+            node = edge.child
+        return path
+
+    def search(self, simulation_no, deadline=None):
+        """Run simulation_no iterations of selection, rollout and backpropagation,
+        or less if the deadline is past."""
+        for i in range(simulation_no):
+            if i and expired(deadline):
+                break
+            path = self._tree_policy()
+            leaf = path[-1].child if path else self.root
+            reward = simulate(leaf.state.clone(), MonteCarloTreeSearchNode.player_number,
+                              to_move=leaf.player)
+            self.root.visits += 1
+            self.root.points += reward
+            for edge in path:
+                edge.visits += 1
+                edge.points += reward
+                edge.child.visits += 1
+                edge.child.points += reward
+
+    def best_action(self, simulation_no=1000, deadline=None):
+        """Returns the most visited move from the root after simulation_no iterations."""
+        self.search(simulation_no, deadline)
+        return max(self.root.edges, key=lambda e: e.visits).action
+
+    def root_stats(self):
+        """Returns the statistics of the root edges as (action, visits, points, proven) tuples."""
+        return [(e.action, e.visits, e.points, None) for e in self.root.edges]
+
+
+def make_search(kind: str, board: Board, max_nodes=None):
+    """
+    Returns the root of a new search of the given kind ("tree" or "dag").
+    max_nodes bounds the size of a tree search (None for no bound).
+    """
+    if kind == "dag":
+        return MonteCarloGraphSearch(board)
+    return MonteCarloTreeSearchNode(board, pool=NodePool(max_nodes))
+
+
+def _rollout_worker(args):
+    """
+    Pool task for leaf parallelization: one rollout from a leaf board.
+    Returns the result and the move_key of the actions played.
+    """
+    m, player, to_move, seed = args
+    random.seed(seed)
+    moves = []
+    return simulate(ActiveCellBoard(m), player, moves, to_move), moves
+
+def _root_worker(args):
+    """
+    Pool task for root parallelization: grow an independent tree until
+    simulation_no iterations are done or the deadline is past, and return
+    the statistics of its root children as (action, visits, points, proven) tuples.
+    """
+    m, player, simulation_no, kind, max_nodes, rave_k, seed, deadline = args
+    random.seed(seed)
+    MonteCarloTreeSearchNode.player_number = player
+    MonteCarloTreeSearchNode.rave_k = rave_k
+    root = make_search(kind, ActiveCellBoard(m), max_nodes)
+    root.search(simulation_no, deadline)
+    return root.root_stats()
+
+def root_parallel_search(board: Board, player: int, simulation_no: int, pool, workers: int, kind="tree", max_nodes=None,
+                         deadline=None):
+    """
+    Search board with workers independent trees of at most simulation_no
+    iterations each, all stopped at the deadline, and merge what they have
+    visited. Returns the action with the most merged root visits, or a move
+    proven to win by any of the trees, and the number of simulations run
+    by all the trees.
+    """
+    tasks = [(board.m, player, simulation_no, kind, max_nodes,
+              MonteCarloTreeSearchNode.rave_k, random.getrandbits(32), deadline)
+             for _ in range(workers)]
+    visits = {}
+    points = {}
+    won = None
+    for stats in pool.map(_root_worker, tasks):
+        for action, n, q, proven in stats:
+            action = tuple(action)
+            if proven is not None and proven > 0:
+                won = action
+            visits[action] = visits.get(action, 0) + n
+            points[action] = points.get(action, 0) + q
+    simulations = int(sum(visits.values()))
+    if won is not None:
+        return won, simulations
+    return max(visits, key=lambda a: (visits[a], points[a] / visits[a])), simulations
+
+
 class MyAgent(Agent):
 
     """My Avalam agent."""
-    def __init__(self):
+    # share of the time credit left per move that the search may use, kept
+    # below 1 for the exchanges with the game and the worker processes
+    time_margin = 0.9
+    def __init__(self, workers=1, parallel="root", simulation_no=1000, search="tree", max_nodes=None,
+                 rave_k=None, report_stats=False, book=None, tablebase=None, eval_cache=None):
         self.root: MonteCarloTreeSearchNode = None
+        self.book = book
+        self.tablebase = tablebase
+        self.eval_cache = eval_cache
+        self.report_stats = report_stats
+        self.max_nodes = max_nodes
+        self.rave_k = rave_k
+        self.workers = workers
+        self.parallel = parallel
+        self.simulation_no = simulation_no
+        self.search = search
+        self.pool = None
+
+    def get_pool(self):
+        """Return the worker pool, creating it on first use."""
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+        return self.pool
+
+    def move_deadline(self, board: ActiveCellBoard, time_left):
+        """
+        Returns the wall-clock time (time.time()) at which the search of the
+        move stops, or None in an untimed game. The time credit left is
+        spread over the moves the agent may still have to play, at most half
+        of the moves left in the game.
+        """
+        if time_left is None:
+            return None
+        moves = board.get_moves_left_bound() // 2 + 1
+        return time.time() + self.time_margin * time_left / moves
+
+    def end_game(self):
+        """Stop the worker pool, the copies of the agent made for every game
+        by the multi-game servers would otherwise each keep their own."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
     
     def play(self, percepts: dict, player: int, step, time_left: float):
         """
@@ -257,19 +771,125 @@ class MyAgent(Agent):
         :return: an action
             eg; (1, 4, 1 , 3) to move tower on cell (1,4) to cell (1,3)
         """
-        current_state: Board = dict_to_board(percepts)
+        current_state: Board = dict_to_board_active(percepts)
         MonteCarloTreeSearchNode.player_number = player
+        MonteCarloTreeSearchNode.rave_k = self.rave_k
+        MonteCarloTreeSearchNode.tablebase = self.tablebase
+        MonteCarloTreeSearchNode.eval_cache = self.eval_cache
         
-        start_node = MonteCarloTreeSearchNode(current_state)
         print("percept:", percepts)
         print("player:", player)
         print("step:", step)
         print("time left:", time_left if time_left else '+inf')
-        return start_node.best_action().parent_action
-        
-        
+        start = time.perf_counter()
+        deadline = self.move_deadline(current_state, time_left)
+        start_node = None
+        if self.book is not None:
+            entry = self.book.probe(current_state)
+            if entry is not None:
+                print("book move:", entry[0])
+                if not self.report_stats:
+                    return entry[0]
+                return report(entry[0], time.perf_counter() - start, book=True)
+        if self.tablebase is not None:
+            entry = self.tablebase.best_action(current_state, player)
+            if entry is not None:
+                print("tablebase move:", entry[0])
+                if not self.report_stats:
+                    return entry[0]
+                return report(entry[0], time.perf_counter() - start, tablebase=True)
+        if self.workers > 1 and self.parallel == "root":
+            action, simulations = root_parallel_search(
+                current_state, player, self.simulation_no, self.get_pool(), self.workers,
+                self.search, self.max_nodes, deadline)
+        else:
+            start_node = make_search(self.search, current_state, self.max_nodes)
+            if self.search == "dag":
+                action = start_node.best_action(self.simulation_no, deadline)
+                simulations = start_node.root.visits
+            elif self.workers > 1:
+                start_node.leaf_parallel_search(self.simulation_no, self.get_pool(),
+                                                self.workers, deadline)
+                action = start_node.most_visited_child().parent_action
+                simulations = int(start_node.n())
+            else:
+                action = start_node.best_action(self.simulation_no, deadline).parent_action
+                simulations = int(start_node.n())
+        print("simulations:", simulations)
+        if not self.report_stats:
+            return action
+        return report(action, time.perf_counter() - start, simulations=simulations,
+                      nodes=None if start_node is None else start_node.count_nodes())
+
+
+def add_arguments(agent, parser):
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of search processes (default: %(default)s)")
+    parser.add_argument("--parallel", choices=("root", "leaf"), default="root",
+                        help="parallelization scheme when using several" +
+                             " workers (default: %(default)s)")
+    parser.add_argument("-n", "--simulations", type=int, default=1000,
+                        help="maximum number of simulations per move and per" +
+                             " root worker, timed games stop searching earlier" +
+                             " to stay within the time credit (default:" +
+                             " %(default)s)")
+    parser.add_argument("--search", choices=("tree", "dag"), default="tree",
+                        help="store nodes in a tree or in a transposition" +
+                             " table keyed by position hash (default: %(default)s)")
+    parser.add_argument("--max-nodes", type=int, default=None,
+                        help="prune the least visited subtrees of the tree" +
+                             " search to stay below this number of nodes" +
+                             " (default: unbounded)")
+    parser.add_argument("--rave", type=float, default=None, metavar="K",
+                        help="blend AMAF statistics into the tree search" +
+                             " selection, K being the number of visits at" +
+                             " which both weigh the same (default: disabled)")
+    parser.add_argument("--report-stats", action="store_true", default=False,
+                        help="return the think time and the search size with" +
+                             " every action, for game.py --metrics")
+    parser.add_argument("--book", metavar="FILE",
+                        help="play the moves of the opening book FILE" +
+                             " (see opening_book.py) while in book")
+    parser.add_argument("--tablebase", metavar="FILE",
+                        help="end the playouts and play the endgames with the" +
+                             " exact results of the tablebase FILE (see" +
+                             " tablebase.py)")
+    parser.add_argument("--regions", type=int, metavar="N",
+                        help="solve exactly the positions of up to N" +
+                             " interacting towers, split into independent" +
+                             " groups (see regions.py)")
+    parser.add_argument("--eval-cache", type=int, default=0, metavar="N",
+                        help="cache the results of the last N terminal" +
+                             " positions (default: disabled)")
+
+def setup(agent, parser, args):
+    if args.workers < 1:
+        parser.error("the number of workers must be at least 1")
+    if args.search == "dag" and args.workers > 1 and args.parallel == "leaf":
+        parser.error("leaf parallelization is only available for the tree search")
+    if args.max_nodes is not None and args.max_nodes < 2:
+        parser.error("the node budget must be at least 2")
+    agent.workers = args.workers
+    agent.parallel = args.parallel
+    agent.simulation_no = args.simulations
+    agent.search = args.search
+    agent.max_nodes = args.max_nodes
+    agent.rave_k = args.rave
+    agent.report_stats = args.report_stats
+    if args.book is not None:
+        from opening_book import OpeningBook
+        agent.book = OpeningBook(args.book)
+    if args.tablebase is not None:
+        from tablebase import Tablebase
+        agent.tablebase = Tablebase(args.tablebase)
+    if args.regions is not None:
+        from regions import RegionSolver
+        agent.tablebase = RegionSolver(agent.tablebase, args.regions)
+    if args.eval_cache > 0:
+        from eval_cache import EvalCache
+        agent.eval_cache = EvalCache(args.eval_cache)
 
 
 if __name__ == "__main__":
-    agent_main(MyAgent())
+    agent_main(MyAgent(), add_arguments, setup)
 
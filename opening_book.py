@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Opening book of Avalam, computed offline by deep searches.
+
+The first plies have hundreds of legal moves and the agents would spend
+their full search time on them every game. The book stores, for the
+positions an agent can meet in its first moves, the move and the score
+found by a deep minimax search, so that the agent answers instantly while
+in book.
+
+The positions are those reached from the initial board when the side to
+move played book moves and its opponent any move: the initial board for
+Player 1, its 292 successors for Player 2, and so on up to the requested
+number of plies. They are searched in parallel, one task per position.
+
+The book is stored in the layout of game_store.write_arrays, under the
+magic b"AVOB": the Zobrist hashes (Board.get_hash) of the positions
+sorted, and per position the move, the score from the point of view of
+Player 1 and the search depth. It is memory-mapped and probed by binary
+search.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import multiprocessing
+import time
+
+import numpy as np
+
+from avalam import Board, PLAYER1
+from custom_board import CustomBoard
+from game_store import map_arrays, write_arrays
+import my_player
+
+BOOK_MAGIC = b"AVOB"
+BOOK_VERSION = 1
+
+
+def search_position(task):
+    """Search the position m with my_player's minimax to a fixed depth.
+
+    task is (m, player, depth). Return (score, action), score being from
+    the point of view of Player 1.
+
+    """
+    m, player, depth = task
+    algorithm = my_player.MinmaxAlphaBetaIterativeDepth()
+    algorithm.first_run = True  # no time cut
+    algorithm.start_time = time.time()
+    algorithm.remaining_time = float("inf")
+    board = CustomBoard(m)
+    apply = algorithm.apply_max if player == PLAYER1 else algorithm.apply_min
+    return apply(depth, board, float("-inf"), float("inf"))
+
+
+def book_positions(book_moves, plies, board=None):
+    """Return {hash: (m, player)} for the positions of the first plies that
+    need a book move, given the book moves {hash: action} already known.
+
+    Positions whose side to move has a book move are followed through it
+    only, the others through all their moves. The side to move is PLAYER1
+    on the initial board and alternates, as every move removes one tower.
+
+    """
+    board = board or Board()
+    positions = {}
+
+    def visit(board, player, ply, book_player):
+        if ply >= plies or board.is_finished():
+            return
+        h = board.get_hash()
+        if player == book_player:
+            if h not in book_moves:
+                positions[h] = (board.m, player)
+                return
+            actions = [book_moves[h]]
+        else:
+            actions = board.get_actions()
+        for action in actions:
+            visit(board.clone().play_action(action), -player, ply + 1,
+                  book_player)
+    for book_player in (PLAYER1, -PLAYER1):
+        visit(board, PLAYER1, 0, book_player)
+    return positions
+
+
+def build_book(path, plies=3, depth=3, jobs=1, log=None):
+    """Search the positions of the first plies at depth and write the book
+    to path.
+
+    Arguments:
+    path -- file to write
+    plies -- number of plies covered by the book
+    depth -- depth of the minimax searches
+    jobs -- number of search processes
+    log -- function called with a message after every ply (None to
+        disable)
+
+    Return the number of positions in the book.
+
+    """
+    entries = {}  # hash -> (action, score)
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        # the positions of ply k depend on the book moves of the plies
+        # before: search them one ply at a time
+        for ply in range(1, plies + 1):
+            start = time.perf_counter()
+            positions = book_positions({h: a for h, (a, s) in
+                                        entries.items()}, ply)
+            keys = list(positions)
+            tasks = [positions[h] + (depth,) for h in keys]
+            results = pool.map(search_position, tasks) if pool is not None \
+                else map(search_position, tasks)
+            for h, (score, action) in zip(keys, results):
+                entries[h] = (action, score)
+            if log is not None:
+                log("ply %d: %d positions searched in %.1fs" %
+                    (ply, len(keys), time.perf_counter() - start))
+    finally:
+        if pool is not None:
+            pool.close()
+    keys = np.array(sorted(entries), np.uint64)
+    board = Board()
+    header = {"rows": board.rows, "columns": board.columns,
+              "max_height": board.max_height, "plies": plies, "depth": depth}
+    write_arrays(path, BOOK_MAGIC, BOOK_VERSION, header, {
+        "keys": keys,
+        "moves": np.array([entries[int(h)][0] for h in keys],
+                          np.int8).reshape(-1, 4),
+        "scores": np.array([entries[int(h)][1] for h in keys], np.float32),
+    })
+    return len(keys)
+
+
+class OpeningBook:
+
+    """Read-only, memory-mapped view of a book written by build_book."""
+
+    def __init__(self, path):
+        try:
+            self.buf, header, arrays = map_arrays(path, BOOK_MAGIC,
+                                                  BOOK_VERSION)
+        except ValueError:
+            raise ValueError("not an Avalam opening book: %s" % path)
+        self.shape = (header["rows"], header["columns"],
+                      header["max_height"])
+        self.plies = header["plies"]
+        self.depth = header["depth"]
+        self.keys = arrays["keys"]
+        self.moves = arrays["moves"]
+        self.scores = arrays["scores"]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def probe(self, board):
+        """Return (action, score) for board, or None if out of book."""
+        if (board.rows, board.columns, board.max_height) != self.shape:
+            return None
+        h = board.get_hash()
+        k = int(np.searchsorted(self.keys, np.uint64(h)))
+        if k == len(self.keys) or int(self.keys[k]) != h:
+            return None
+        action = tuple(int(x) for x in self.moves[k])
+        if not board.is_action_valid(action):  # hash collision
+            return None
+        return action, float(self.scores[k])
+
+    def close(self):
+        self.keys = self.moves = self.scores = None
+        self.buf.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("book", help="book file to write")
+    parser.add_argument("-p", "--plies", type=int, default=3,
+                        help="number of plies covered (default: %(default)s)")
+    parser.add_argument("-d", "--depth", type=int, default=3,
+                        help="depth of the searches (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of search processes" +
+                             " (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.plies < 1 or args.depth < 1 or args.jobs < 1:
+        parser.error("plies, depth and jobs must be at least 1")
+    start = time.perf_counter()
+    n = build_book(args.book, args.plies, args.depth, args.jobs,
+                   lambda message: print(message, flush=True))
+    print("%d positions written to %s in %.1fs" %
+          (n, args.book, time.perf_counter() - start))
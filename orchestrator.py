@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Asyncio orchestrator running many Avalam games concurrently in one process.
+
+Unlike game.Game, which blocks on every call and bounds it with the
+process-wide socket.setdefaulttimeout, the games run here are coroutines
+sharing one event loop. Every call to an agent gets its own deadline and
+time credits are accounted on the monotonic clock. Agents are remote
+servers, reached over XML-RPC (http://) or the binary protocol of
+agent_protocol (unix://, tcp://). Agents served with --multi-game can play
+all the games at once: pass --game-ids so that every game is identified.
+Other agents play one game at a time.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import urllib.parse
+import xmlrpc.client
+
+import agent_protocol
+from avalam import Board, InvalidAction, split_report
+from game import TimeCreditExpired, Trace
+from tournament import standings
+
+
+class AsyncXMLRPCAgent:
+
+    """Coroutine proxy for an agent served over XML-RPC.
+
+    Every call opens its own HTTP connection, as SimpleXMLRPCServer closes
+    it after each response. If game_id is not None, it is prepended to the
+    arguments of every call (see avalam.serve_agent_multi).
+
+    """
+
+    def __init__(self, uri, game_id=None):
+        parts = urllib.parse.urlsplit(uri)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 80
+        self.path = parts.path or "/RPC2"
+        self.game_id = game_id
+
+    async def call(self, method, *params):
+        if self.game_id is not None:
+            params = (self.game_id,) + params
+        body = xmlrpc.client.dumps(params, method,
+                                   allow_none=True).encode("utf-8")
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(("POST %s HTTP/1.1\r\n"
+                          "Host: %s:%d\r\n"
+                          "Content-Type: text/xml\r\n"
+                          "Content-Length: %d\r\n"
+                          "Connection: close\r\n\r\n" %
+                          (self.path, self.host, self.port,
+                           len(body))).encode("ascii") + body)
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("iso-8859-1").split("\r\n")
+            status = lines[0].split(None, 2)
+            if len(status) < 2 or status[1] != "200":
+                raise xmlrpc.client.ProtocolError(self.host + self.path,
+                                                  int(status[1]),
+                                                  lines[0], {})
+            length = None
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            if length is None:
+                data = await reader.read()
+            else:
+                data = await reader.readexactly(length)
+        finally:
+            writer.close()
+        return xmlrpc.client.loads(data)[0][0]
+
+    async def initialize(self, board, players, time_left):
+        return await self.call("initialize", board, players, time_left)
+
+    async def play(self, board, player, step, time_left):
+        return await self.call("play", board, player, step, time_left)
+
+    async def close(self):
+        if self.game_id is not None:
+            # the server only answers once the worker of the game is done
+            # with the calls abandoned on timeout, do not wait for it
+            await asyncio.wait_for(self.call("end_game"), 1.0)
+
+
+class AsyncBinaryAgent:
+
+    """Coroutine proxy for an agent served with the binary protocol, over
+    one persistent connection."""
+
+    def __init__(self, uri):
+        self.family, self.address = agent_protocol.parse_address(uri)
+        self.reader = self.writer = None
+
+    async def call(self, payload):
+        if self.writer is None:
+            if self.family == socket.AF_UNIX:
+                self.reader, self.writer = \
+                    await asyncio.open_unix_connection(self.address)
+            else:
+                self.reader, self.writer = \
+                    await asyncio.open_connection(*self.address)
+                self.writer.get_extra_info("socket").setsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            length = agent_protocol.FRAME_LENGTH
+            self.writer.write(length.pack(len(payload)) + payload)
+            await self.writer.drain()
+            n, = length.unpack(await self.reader.readexactly(length.size))
+            response = await self.reader.readexactly(n)
+        except BaseException:
+            # a cancelled call leaves the stream in an unknown state
+            await self.close()
+            raise
+        return agent_protocol.decode_response(response)
+
+    async def initialize(self, board, players, time_left):
+        return await self.call(agent_protocol.encode_request(
+            agent_protocol.OP_INITIALIZE, board.m, board.max_height,
+            len(players), 0, time_left, players))
+
+    async def play(self, board, player, step, time_left):
+        return await self.call(agent_protocol.encode_request(
+            agent_protocol.OP_PLAY, board.m, board.max_height, player, step,
+            time_left))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+def is_binary(uri):
+    """Return whether uri is served with the binary protocol."""
+    return uri.partition("://")[0] in agent_protocol.SCHEMES
+
+
+def connect_agent(uri, game_id=None):
+    """Return a coroutine proxy for the agent served at uri."""
+    if is_binary(uri):
+        return AsyncBinaryAgent(uri)
+    return AsyncXMLRPCAgent(uri, game_id)
+
+
+class AsyncGame:
+
+    """An Avalam game between two remote agents, played as a coroutine.
+
+    The rules, time accounting and trace are those of game.Game, without
+    viewer.
+
+    """
+
+    def __init__(self, agents, board, credits=[None, None]):
+        """New Avalam game.
+
+        Arguments:
+        agents -- a sequence of 2 elements containing the agent proxies
+        board -- the board on which to play
+        credits -- a sequence of 2 elements containing the time credit in
+            seconds for each agent, or None for a time-unlimitted agent
+
+        """
+        self.agents = agents
+        self.board = board
+        self.credits = list(credits)
+        self.step = 0
+        self.player = 1
+        self.trace = Trace(board, credits)
+
+    async def play(self):
+        """Play the game and return its trace."""
+        try:
+            while not self.board.is_finished():
+                self.step += 1
+                action, t = await self.timed_exec("play", self.board,
+                                                  self.player, self.step)
+                self.board.play_action(action)
+                self.trace.add_action(self.player, action, t)
+                self.player = -self.player
+        except (TimeCreditExpired, InvalidAction) as e:
+            if isinstance(e, TimeCreditExpired):
+                reason = "Opponent's time credit has expired."
+            else:
+                reason = "Opponent has played an invalid action."
+            winner = -self.player
+            self.step += 1
+        else:
+            reason = ""
+            winner = self.board.get_score()
+        self.trace.set_winner(winner, reason)
+        return self.trace
+
+    async def timed_exec(self, fn, *args):
+        """Await self.agents[agent].fn(*args, time_left) for the current
+        player, with a deadline of its time credit plus one second.
+
+        Return a tuple (result, t) with the function result and the time taken
+        in seconds.
+
+        """
+        agent = 0 if self.player > 0 else 1
+        credit = self.credits[agent]
+        if credit is not None and credit < 0:
+            raise TimeCreditExpired
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                getattr(self.agents[agent], fn)(*args + (credit,)),
+                None if credit is None else credit + 1)
+            result = split_report(result)[0]
+        except asyncio.TimeoutError:
+            self.credits[agent] = -1.0  # ensure it is counted as expired
+            raise TimeCreditExpired
+        except Exception as e:
+            logging.error("Player %d was unable to play step %d." +
+                          " Reason: %s", agent + 1, self.step, e)
+            raise InvalidAction
+        t = time.monotonic() - start
+        if credit is not None:
+            self.credits[agent] -= t
+            if self.credits[agent] < -0.5:  # small epsilon to be sure
+                raise TimeCreditExpired
+        return (result, t)
+
+
+async def play_game(game_id, uris, time_credit=None, game_ids=False,
+                    trace_dir=None):
+    """Play one game between the agents served at uris and return its
+    record as tournament.play_game does."""
+    # each side gets its own id, both may be played by the same server
+    agents = [connect_agent(uri, "%d:%d" % (game_id, i + 1) if game_ids
+                            else None)
+              for i, uri in enumerate(uris)]
+    game = AsyncGame(agents, Board(), [time_credit, time_credit])
+    start = time.monotonic()
+    try:
+        trace = await game.play()
+    finally:
+        for agent in agents:
+            try:
+                await agent.close()
+            except Exception as e:
+                logging.warning("Unable to close agent: %s", e)
+    duration = time.monotonic() - start
+    if trace_dir is not None:
+        with open(os.path.join(trace_dir, "game_%05d.trace" % game_id),
+                  "wb") as f:
+            trace.write(f)
+    times = [sum(t for p, a, t in trace.actions if p == player)
+             for player in (1, -1)]
+    return {"type": "game",
+            "id": game_id,
+            "agents": list(uris),
+            "winner": trace.winner,
+            "reason": trace.reason,
+            "steps": len(trace.actions),
+            "time_used": times,
+            "duration": duration}
+
+
+async def run_matches(matches, output, concurrency=1, time_credit=None,
+                      game_ids=False, trace_dir=None):
+    """Play the (uri1, uri2) matches, at most concurrency at a time, and
+    write one JSON line per game to output followed by the standings.
+    Return the standings.
+
+    Simultaneous games need agents served with serve_agent_multi and
+    game_ids: a plain XML-RPC server plays all its games with one agent,
+    whose state and time they would share, and a binary protocol server
+    plays them all in one process. A concurrency above 1 is refused
+    otherwise.
+
+    """
+    if concurrency > 1:
+        if any(is_binary(uri) for uris in matches for uri in uris):
+            raise ValueError("binary protocol agents cannot play concurrent"
+                             " games, use a concurrency of 1")
+        if not game_ids:
+            raise ValueError("concurrent games need game ids and agents"
+                             " served with --multi-game")
+    semaphore = asyncio.Semaphore(concurrency)
+    records = []
+    start = time.monotonic()
+
+    async def run(game_id, uris):
+        async with semaphore:
+            record = await play_game(game_id, uris, time_credit, game_ids,
+                                     trace_dir)
+        records.append(record)
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+        logging.info("Game %d/%d: %s vs %s -> %+d %s", len(records),
+                     len(matches), uris[0], uris[1], record["winner"],
+                     record["reason"])
+
+    await asyncio.gather(*(run(i, uris) for i, uris in enumerate(matches)))
+    result = standings(records)
+    result["games_per_hour"] = len(records) * 3600 / (time.monotonic() - start)
+    output.write(json.dumps(result) + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def posfloatarg(string):
+        value = float(string)
+        if value <= 0:
+            raise argparse.ArgumentTypeError("%s is not strictly positive" %
+                                             string)
+        return value
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("agent1", help="URI of the first agent")
+    parser.add_argument("agent2", help="URI of the second agent")
+    parser.add_argument("-g", "--games", type=int, default=1,
+                        help="number of games per color" +
+                             " (default: %(default)s)")
+    parser.add_argument("-c", "--concurrency", type=int, default=1,
+                        help="maximum number of games played at once, more" +
+                             " than 1 requires --game-ids (default:" +
+                             " %(default)s)")
+    parser.add_argument("-t", "--time", type=posfloatarg,
+                        help="set the time credit per player (default:" +
+                             " untimed games)",
+                        metavar="SECONDS")
+    parser.add_argument("--game-ids", action="store_true", default=False,
+                        help="identify every game to XML-RPC agents served" +
+                             " with --multi-game")
+    parser.add_argument("-o", "--output", type=argparse.FileType("w"),
+                        default="matches.jsonl",
+                        help="write the results to FILE" +
+                             " (default: %(default)s)",
+                        metavar="FILE")
+    parser.add_argument("--traces", metavar="DIR",
+                        help="write the trace of every game in DIR")
+    parser.add_argument("-v", "--verbose", action="store_true", default=False,
+                        help="be verbose")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s -- %(levelname)s: %(message)s",
+                        level=logging.INFO if args.verbose else logging.WARNING)
+    if args.concurrency > 1 and (is_binary(args.agent1) or
+                                 is_binary(args.agent2)):
+        parser.error("binary protocol agents (%s) cannot play concurrent"
+                     " games: use -c 1, or XML-RPC agents served with"
+                     " --multi-game" % ", ".join(agent_protocol.SCHEMES))
+    if args.concurrency > 1 and not args.game_ids:
+        parser.error("concurrent games share the agent of a plain server:"
+                     " use -c 1, or --game-ids with agents served with"
+                     " --multi-game")
+    if args.traces is not None:
+        os.makedirs(args.traces, exist_ok=True)
+
+    matches = []
+    for _ in range(args.games):
+        matches.append((args.agent1, args.agent2))
+        matches.append((args.agent2, args.agent1))
+    result = asyncio.run(run_matches(matches, args.output, args.concurrency,
+                                     args.time, args.game_ids, args.traces))
+    args.output.close()
+    for name, s in sorted(result["agents"].items()):
+        print("%-40s %6d wins %6d draws %6d losses %+8.2f margin" %
+              (name, s["wins"], s["draws"], s["losses"], s["margin"]))
+    print("%.1f games per hour" % result["games_per_hour"])
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Perft: move generation benchmark and validation for the Avalam boards.
+
+Counts the leaf nodes of the full game tree to a given depth from the
+initial board and from stored mid-game positions, with every board
+implementation, reports the nodes per second of each and checks that they
+all find the same counts, as well as the reference counts stored here.
+Deep counts can be split over a process pool, one task per root move.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import functools
+import multiprocessing
+import time
+
+from avalam import Board
+from custom_board import ActiveCellBoard, CustomBoard
+
+
+# (name, board, default depth), mid-game positions reached by random play
+POSITIONS = [
+    ("initial", Board.initial_board, 2),
+    ("midgame-8",
+     [[0, 0, 1, -1, 0, 0, 0, 0, 0],
+      [0, 1, -1, 1, -1, 0, 0, 0, 0],
+      [0, -1, 0, 2, 1, -1, 1, 0, 0],
+      [0, 1, -1, 1, 0, -2, -1, 1, -1],
+      [1, -1, 0, 0, 0, -1, 2, 0, -2],
+      [-1, 1, 3, 1, 0, 0, -1, 1, 0],
+      [0, 0, 1, -2, 1, -1, 1, -1, 0],
+      [0, 0, 0, 0, -1, -2, 0, 1, 0],
+      [0, 0, 0, 0, 0, -1, 1, 0, 0]], 2),
+    ("midgame-16",
+     [[0, 0, 1, -1, 0, 0, 0, 0, 0],
+      [0, 0, 0, 1, -1, 0, 0, 0, 0],
+      [0, -5, 0, -1, 0, -1, 1, 0, 0],
+      [0, 0, 3, -2, 0, 2, -1, 0, 2],
+      [1, -3, 0, -1, 0, 0, 0, -1, 0],
+      [-1, 0, 0, 0, -1, 1, -3, 2, 0],
+      [0, 0, 1, -1, 0, -1, 1, -1, 0],
+      [0, 0, 0, 0, 2, 1, -1, 2, 0],
+      [0, 0, 0, 0, 0, -1, 0, 0, 0]], 3),
+    ("endgame-24",
+     [[0, 0, -2, 0, 0, 0, 0, 0, 0],
+      [0, 0, -1, 1, -3, 0, 0, 0, 0],
+      [0, 3, 0, 0, 2, 0, 0, 0, 0],
+      [0, 0, 0, 0, -4, 2, -4, 0, -1],
+      [2, 2, 1, 0, 0, -1, 0, 0, 1],
+      [-1, 0, -1, 0, 0, 0, 0, 1, 0],
+      [0, 0, 1, 5, 2, 0, -2, 0, 0],
+      [0, 0, 0, 0, 0, 0, 4, 1, 0],
+      [0, 0, 0, 0, 0, 0, 0, 0, 0]], 4),
+]
+
+# reference leaf counts, by position name and depth
+EXPECTED = {
+    "initial": {1: 292, 2: 81488, 3: 21711440},
+    "midgame-8": {1: 184, 2: 32020, 3: 5259164},
+    "midgame-16": {1: 114, 2: 11924, 3: 1140204, 4: 99277968},
+    "endgame-24": {1: 46, 2: 1848, 3: 63944, 4: 1873280, 5: 45478080},
+}
+
+
+def perft_board(cls, m, depth):
+    """Count the leaves at depth plies of m through the cls Board API."""
+    def perft(board, depth):
+        actions = list(board.get_actions())
+        if depth == 1:
+            return len(actions)
+        return sum(perft(board.clone().play_action(a), depth - 1)
+                   for a in actions)
+    if depth == 0:
+        return 1
+    return perft(cls(m), depth)
+
+
+def perft_flat(m, depth, max_height=Board.max_height):
+    """Count the leaves at depth plies of m on a flat list of cells, with
+    precomputed neighbours and make/unmake instead of clones."""
+    rows, columns = len(m), len(m[0])
+    cells = [x for row in m for x in row]
+    neighbours = [[(i + di) * columns + j + dj
+                   for di in (-1, 0, 1) for dj in (-1, 0, 1)
+                   if (di or dj) and 0 <= i + di < rows and
+                   0 <= j + dj < columns]
+                  for i in range(rows) for j in range(columns)]
+
+    def perft(depth):
+        count = 0
+        for a, x in enumerate(cells):
+            h1 = x if x > 0 else -x
+            if h1 == 0 or h1 >= max_height:
+                continue
+            for b in neighbours[a]:
+                y = cells[b]
+                h = h1 + (y if y > 0 else -y)
+                if y == 0 or h > max_height:
+                    continue
+                if depth == 1:
+                    count += 1
+                    continue
+                cells[a] = 0
+                cells[b] = h if x > 0 else -h
+                count += perft(depth - 1)
+                cells[a] = x
+                cells[b] = y
+        return count
+    if depth == 0:
+        return 1
+    return perft(depth)
+
+
+IMPLEMENTATIONS = {
+    "active": functools.partial(perft_board, ActiveCellBoard),
+    "avalam": functools.partial(perft_board, Board),
+    "custom": functools.partial(perft_board, CustomBoard),
+    "flat": perft_flat,
+}
+
+
+def _perft_task(task):
+    name, m, depth = task
+    return IMPLEMENTATIONS[name](m, depth)
+
+
+def perft(name, m, depth, pool=None):
+    """Return the number of leaves at depth plies of m with implementation
+    name, split over pool by root move if it is not None."""
+    if pool is None or depth < 2:
+        return IMPLEMENTATIONS[name](m, depth)
+    board = Board(m)
+    tasks = [(name, Board(m).play_action(a).m, depth - 1)
+             for a in board.get_actions()]
+    return sum(pool.imap_unordered(_perft_task, tasks))
+
+
+def divide(m, depth):
+    """Return the leaf count under every root move, for locating a
+    difference between implementations."""
+    board = Board(m)
+    return {a: perft_flat(Board(m).play_action(a).m, depth - 1)
+            for a in board.get_actions()}
+
+
+def run(positions, implementations, depth=None, pool=None):
+    """Count every position with every implementation.
+
+    Return a list of (position, depth, implementation, count, seconds) and
+    a list of error messages, for counts differing between implementations
+    or from EXPECTED.
+
+    """
+    results = []
+    errors = []
+    for name, m, default_depth in positions:
+        d = default_depth if depth is None else depth
+        counts = {}
+        for impl in implementations:
+            start = time.perf_counter()
+            counts[impl] = perft(impl, m, d, pool)
+            results.append((name, d, impl, counts[impl],
+                            time.perf_counter() - start))
+        if len(set(counts.values())) > 1:
+            errors.append("%s depth %d: implementations disagree: %s" %
+                          (name, d, counts))
+        expected = EXPECTED.get(name, {}).get(d)
+        if expected is not None and \
+                any(c != expected for c in counts.values()):
+            errors.append("%s depth %d: expected %d, got %s" %
+                          (name, d, expected, counts))
+    return results, errors
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--depth", type=int,
+                        help="depth of the counts (default: per position," +
+                             " from 2 for the initial board to 4 for the" +
+                             " endgame)")
+    parser.add_argument("-p", "--position", action="append",
+                        choices=[name for name, m, d in POSITIONS],
+                        help="position to count, may be repeated" +
+                             " (default: all)")
+    parser.add_argument("-i", "--implementation", action="append",
+                        choices=sorted(IMPLEMENTATIONS),
+                        help="board implementation to count with, may be" +
+                             " repeated (default: all)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes, root moves being split" +
+                             " among them (default: %(default)s)")
+    parser.add_argument("--divide", action="store_true", default=False,
+                        help="print the count under every root move")
+    args = parser.parse_args()
+
+    positions = [p for p in POSITIONS
+                 if args.position is None or p[0] in args.position]
+    implementations = args.implementation or sorted(IMPLEMENTATIONS)
+    if args.divide:
+        for name, m, d in positions:
+            d = d if args.depth is None else args.depth
+            print("%s depth %d" % (name, d))
+            for action, count in sorted(divide(m, d).items()):
+                print("  %s %d" % (action, count))
+        sys.exit(0)
+
+    pool = multiprocessing.Pool(args.jobs) if args.jobs > 1 else None
+    results, errors = run(positions, implementations, args.depth, pool)
+    print("%-12s %5s %-8s %12s %9s %12s" % ("position", "depth", "board",
+                                            "leaves", "seconds", "leaves/s"))
+    for name, d, impl, count, t in results:
+        print("%-12s %5d %-8s %12d %9.3f %12.0f" % (name, d, impl, count, t,
+                                                    count / t if t else 0))
+    for error in errors:
+        print("ERROR:", error)
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Region decomposition of Avalam endgames.
+
+As the game progresses, the towers that still interact (see tablebase.py)
+split into groups that can never reach each other: no move links two
+groups, and none ever will. A search over the whole board interleaves the
+moves of all the groups and explores every order of them, although the
+moves of different groups commute.
+
+RegionSolver solves endgames exactly on the decomposed board. A position
+is the sorted tuple of the keys of its groups, so that all the orders of
+independent moves meet in one entry, and every group caches its own moves
+(and the groups they leave) keyed by its local configuration. A single
+group small enough for the tablebase is looked up there. The groups are
+not solved independently: the player to move chooses the group to play in,
+and with no passing this choice matters, so their outcomes do not simply
+add up.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import time
+
+from avalam import Board
+from tablebase import (NEIGHBOURS, Solver, Tablebase, board_cells,
+                       config_cells, config_key, split_frozen)
+
+
+def components(cells, max_height):
+    """Split the interacting towers cells ({(i, j): value}) into groups
+    linked by legal moves. Return a list of {(i, j): value}."""
+    groups = []
+    seen = set()
+    for start in cells:
+        if start in seen:
+            continue
+        seen.add(start)
+        group = {}
+        stack = [start]
+        while stack:
+            i, j = stack.pop()
+            v = cells[i, j]
+            group[i, j] = v
+            for di, dj in NEIGHBOURS:
+                c = (i + di, j + dj)
+                w = cells.get(c)
+                if w and c not in seen and abs(v) + abs(w) <= max_height:
+                    seen.add(c)
+                    stack.append(c)
+        groups.append(group)
+    return groups
+
+
+class RegionSolver(Tablebase):
+
+    """Exact endgame solver on independent groups of towers, probed as a
+    Tablebase for the positions of up to limit interacting towers.
+
+    The caches are cleared as soon as they exceed max_entries positions or
+    groups, even in the middle of a search: a group key holds its cells,
+    which are decoded again once dropped from the cache.
+
+    """
+
+    def __init__(self, tablebase=None, limit=10, max_height=Board.max_height,
+                 max_entries=1000000):
+        self.tablebase = tablebase
+        self.max_height = tablebase.max_height if tablebase is not None \
+            else max_height
+        self.k = limit
+        self.max_entries = max_entries
+        self.solver = tablebase.solver if tablebase is not None \
+            else Solver(self.max_height)
+        self.clear()
+
+    def clear(self):
+        self.cells = {}    # group key -> cells, side to move positive
+        self.negated = {}  # group key -> key of the group, colours swapped
+        self.moves = {}    # group key -> [(towers, top, group keys)]
+        self.memo = {}     # sorted tuple of group keys -> outcome
+
+    def __len__(self):
+        return len(self.memo)
+
+    def register(self, cells):
+        """Return the key of the group cells, remembering them."""
+        key = config_key(cells, self.max_height)
+        if key not in self.cells:
+            self.cells[key] = cells
+        return key
+
+    def group_cells(self, key):
+        """Return the cells of the group key."""
+        cells = self.cells.get(key)
+        if cells is None:
+            cells = self.cells[key] = config_cells(key, self.max_height)
+        return cells
+
+    def negate(self, key):
+        """Return the key of the group key with the colours swapped."""
+        negated = self.negated.get(key)
+        if negated is None:
+            negated = self.register({c: -v for c, v in
+                                     self.group_cells(key).items()})
+            self.negated[key] = negated
+            self.negated[negated] = key
+        return negated
+
+    def group_moves(self, key):
+        """Return the moves of the group key, as (towers, top, keys): the
+        towers and maximal height towers differences frozen by the move and
+        the groups left, both for the opponent, who moves next."""
+        moves = self.moves.get(key)
+        if moves is not None:
+            return moves
+        cells = self.group_cells(key)
+        moves = []
+        for (i, j), v in cells.items():
+            h = abs(v)
+            for di, dj in NEIGHBOURS:
+                w = cells.get((i + di, j + dj))
+                if not w or h + abs(w) > self.max_height:
+                    continue
+                child = {c: -x for c, x in cells.items() if c != (i, j)}
+                child[i + di, j + dj] = -(h + abs(w)) if v > 0 \
+                    else h + abs(w)
+                towers, top = split_frozen(child, self.max_height)
+                moves.append((towers, top, tuple(
+                    self.register(group)
+                    for group in components(child, self.max_height))))
+        self.moves[key] = moves
+        return moves
+
+    def solve(self, keys):
+        """Return the outcome, as Solver.solve, of the position made of the
+        groups keys (a sorted tuple) for the side to move."""
+        if not keys:
+            return 0, 0
+        value = self.memo.get(keys)
+        if value is not None:
+            return value
+        if len(keys) == 1 and self.tablebase is not None and \
+                len(self.group_cells(keys[0])) <= self.tablebase.k:
+            value = self.memo[keys] = self.tablebase.lookup(
+                self.group_cells(keys[0]))
+            return value
+        best = None
+        for n, key in enumerate(keys):
+            if n and key == keys[n - 1]:
+                continue  # same moves as the previous group
+            others = tuple(self.negate(k) for k in keys[:n] + keys[n + 1:])
+            for towers, top, groups in self.group_moves(key):
+                t, m = self.solve(tuple(sorted(others + groups)))
+                value = (-towers - t, -top - m)
+                if best is None or value > best:
+                    best = value
+        if len(self.memo) >= self.max_entries or \
+                len(self.cells) >= self.max_entries:
+            self.clear()
+        self.memo[keys] = best
+        return best
+
+    def lookup(self, cells):
+        """Return the outcome of the interacting towers cells, for the side
+        to move (positive values), as Solver.solve does."""
+        return self.solve(tuple(sorted(
+            self.register(group)
+            for group in components(cells, self.max_height))))
+
+    def close(self):
+        self.clear()
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+
+    import perft
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--towers", type=int, default=10,
+                        help="solve positions of up to this number of" +
+                             " interacting towers (default: %(default)s)")
+    parser.add_argument("-g", "--games", type=int, default=20,
+                        help="number of random endgames (default:" +
+                             " %(default)s)")
+    parser.add_argument("--tablebase", metavar="FILE",
+                        help="look the small groups up in the tablebase FILE")
+    parser.add_argument("--compare", action="store_true", default=False,
+                        help="also solve without decomposition and check" +
+                             " the outcomes")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="random seed (default: %(default)s)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    tablebase = Tablebase(args.tablebase) if args.tablebase else None
+    times = []
+    whole_times = []
+    for game in range(args.games):
+        board = Board(random.choice(perft.POSITIONS)[1])
+        player = 1
+        while board_cells(board, args.towers) is None:
+            board.play_action(random.choice(list(board.get_actions())))
+            player = -player
+        cells, towers, top = board_cells(board)
+        if player < 0:
+            cells = {c: -v for c, v in cells.items()}
+        groups = components(cells, board.max_height)
+        solver = RegionSolver(tablebase, args.towers)
+        start = time.perf_counter()
+        value = solver.lookup(cells)
+        times.append(time.perf_counter() - start)
+        line = "%2d towers, groups %-14s outcome %-9s %8.3fs %7d positions" \
+            % (len(cells), sorted(len(g) for g in groups), value, times[-1],
+               len(solver))
+        if args.compare:
+            whole = Solver(board.max_height)
+            start = time.perf_counter()
+            expected = whole.solve(cells)
+            whole_times.append(time.perf_counter() - start)
+            line += "   whole board %8.3fs %7d positions%s" % (
+                whole_times[-1], len(whole.memo),
+                "" if expected == value else "  MISMATCH %s" % (expected,))
+        print(line, flush=True)
+    print("total %.2fs" % sum(times) +
+          (", whole board %.2fs" % sum(whole_times) if args.compare else ""))
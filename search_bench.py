@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Search benchmark on a fixed suite of positions.
+
+Runs the searches of the agents on every position of a suite with a fixed
+depth, time or simulation budget and reports the nodes searched, nodes per
+second, time to reach every depth, effective branching factor and chosen
+move. Results are written as JSON so that two runs (e.g. two commits) can
+be compared with --compare.
+
+Positions come from perft.POSITIONS by default, from CSV files (as read by
+avalam.load_percepts) or from a game store (game_store.py).
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import json
+import multiprocessing
+import os
+import subprocess
+import time
+
+from avalam import Board, load_percepts
+from custom_board import ActiveCellBoard
+import my_player
+import my_player_pruned
+import my_player_MCTS
+import perft
+
+
+def counting(cls):
+    """Return a subclass of the minimax class cls counting the calls to
+    apply_max and apply_min, and the children evaluated at once by
+    evaluate_children, in self.nodes."""
+    class Counting(cls):
+        nodes = 0
+
+        def apply_max(self, *args):
+            self.nodes += 1
+            return super().apply_max(*args)
+
+        def apply_min(self, *args):
+            self.nodes += 1
+            return super().apply_min(*args)
+
+        def evaluate_children(self, board, actions):
+            self.nodes += len(actions)
+            return super().evaluate_children(board, actions)
+    Counting.__name__ = "Counting" + cls.__name__
+    return Counting
+
+
+class Budget:
+
+    """Search budget: a maximal depth, a time in seconds, or both (the
+    search stops at the first depth completed after the time is spent),
+    and a number of simulations for MCTS, which also stops at the time,
+    run by workers root parallel trees."""
+
+    def __init__(self, depth=None, time=None, simulations=300, workers=1):
+        self.depth = depth
+        self.time = time
+        self.simulations = simulations
+        self.workers = workers
+
+    def to_dict(self):
+        return {"depth": self.depth, "time": self.time,
+                "simulations": self.simulations, "workers": self.workers}
+
+
+def deepen(search, budget):
+    """Call search(depth) for depth 1, 2, ... within budget.
+
+    search returns (move, nodes, done), done telling whether deepening
+    further is pointless, as the agent decides it. Return a result
+    dictionary, time_to_depth listing [depth, seconds, nodes] from the
+    start for every completed depth and ebf being the ratio of the nodes of
+    the last two depths.
+
+    """
+    iterations = []
+    nodes = 0
+    move = None
+    start = time.perf_counter()
+    depth = 1
+    while True:
+        move, n, exhausted = search(depth)
+        nodes += n
+        iterations.append([depth, time.perf_counter() - start, nodes])
+        if exhausted or budget.depth is not None and depth >= budget.depth \
+                or budget.time is not None and \
+                time.perf_counter() - start >= budget.time:
+            break
+        depth += 1
+    elapsed = time.perf_counter() - start
+    per_depth = [n - p for (_, _, n), p in
+                 zip(iterations, [0] + [n for _, _, n in iterations])]
+    return {"move": move, "depth": depth, "nodes": nodes, "time": elapsed,
+            "nps": nodes / elapsed if elapsed else None,
+            "time_to_depth": iterations,
+            "ebf": per_depth[-1] / per_depth[-2] if depth > 1 else None}
+
+
+def bench_iterative(m, player, budget):
+    """my_player.MinmaxAlphaBetaIterativeDepth, one fixed depth search per
+    iteration."""
+    board = ActiveCellBoard(m)
+
+    def search(depth):
+        algorithm = counting(my_player.MinmaxAlphaBetaIterativeDepth)()
+        algorithm.first_run = True  # no time cut
+        move = algorithm._try_minmax(depth, float("inf"), player > 0, board)
+        return move, algorithm.nodes, algorithm.was_max_depth_reached()
+    return deepen(search, budget)
+
+
+def bench_pruned(m, player, budget):
+    """my_player_pruned.MinmaxAlphaBeta, one fixed depth search per
+    iteration."""
+    board = Board(m)
+
+    def search(depth):
+        algorithm = counting(my_player_pruned.MinmaxAlphaBeta)()
+        value, move = algorithm.run_minimax(depth, player > 0, board)
+        return move, algorithm.nodes, False
+    return deepen(search, budget)
+
+
+def bench_mcts(m, player, budget):
+    """my_player_MCTS tree search with budget.simulations simulations, stopped
+    at budget.time, root parallel over budget.workers processes (nodes then
+    counts the simulations, the trees being in the workers)."""
+    my_player_MCTS.MonteCarloTreeSearchNode.player_number = player
+    my_player_MCTS.MonteCarloTreeSearchNode.rave_k = None
+    pool = multiprocessing.Pool(budget.workers) if budget.workers > 1 \
+        else None
+    try:
+        if pool is not None:
+            # the workers are started before the clock
+            pool.map(int, range(budget.workers))
+        start = time.perf_counter()
+        deadline = None if budget.time is None else time.time() + budget.time
+        if pool is not None:
+            move, simulations = my_player_MCTS.root_parallel_search(
+                ActiveCellBoard(m), player, budget.simulations, pool,
+                budget.workers, deadline=deadline)
+            nodes = simulations
+        else:
+            root = my_player_MCTS.make_search("tree", ActiveCellBoard(m))
+            move = root.best_action(budget.simulations, deadline).parent_action
+            simulations = int(root.n())
+            nodes = root.count_nodes()
+        elapsed = time.perf_counter() - start
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return {"move": move, "depth": None, "nodes": nodes, "time": elapsed,
+            "nps": nodes / elapsed if elapsed else None,
+            "simulations": simulations,
+            "simulations_per_second": simulations / elapsed
+            if elapsed else None,
+            "time_to_depth": None, "ebf": None}
+
+
+ENGINES = {
+    "iterative": bench_iterative,
+    "pruned": bench_pruned,
+    "mcts": bench_mcts,
+}
+
+
+def builtin_suite():
+    """Return the perft positions as (name, m, player) triplets."""
+    return [(name, m, 1) for name, m, depth in perft.POSITIONS]
+
+
+def csv_suite(paths, player=1):
+    return [(os.path.basename(path), load_percepts(path), player)
+            for path in paths]
+
+
+def store_suite(path, count):
+    """Return count positions spread over the games of a game store, with
+    the player who moved from them."""
+    from game_store import GameStore
+    store = GameStore(path)
+    games, steps = store.position_games()
+    # positions with a move played from them
+    candidates = [k for k in range(len(games))
+                  if steps[k] < store.length[games[k]]]
+    stride = max(1, len(candidates) // count)
+    suite = []
+    for k in candidates[::stride][:count]:
+        g, s = int(games[k]), int(steps[k])
+        player = int(store.players[store.offsets[g] + s])
+        suite.append(("game%d-step%d" % (g, s),
+                      store.positions[k].tolist(), player))
+    return suite
+
+
+def run(suite, engines, budget, log=None):
+    """Run every engine on every position and return the list of result
+    dictionaries."""
+    results = []
+    for name, m, player in suite:
+        for engine in engines:
+            result = ENGINES[engine](m, player, budget)
+            result["move"] = None if result["move"] is None \
+                else list(result["move"])
+            result.update(position=name, engine=engine)
+            results.append(result)
+            if log is not None:
+                log(result)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def format_result(r):
+    return "%-14s %-10s %5s %10d %8.3f %10.0f %6s  %s" % (
+        r["position"], r["engine"], r["depth"] or "-", r["nodes"], r["time"],
+        r["nps"] or 0, "%.1f" % r["ebf"] if r["ebf"] else "-", r["move"])
+
+
+def compare(old, new):
+    """Return text lines comparing two benchmark outputs, position by
+    position and engine by engine."""
+    before = {(r["position"], r["engine"]): r for r in old["results"]}
+    lines = []
+    for r in new["results"]:
+        o = before.get((r["position"], r["engine"]))
+        if o is None:
+            continue
+        flags = []
+        if o["move"] != r["move"]:
+            flags.append("move %s -> %s" % (o["move"], r["move"]))
+        if o["nodes"] != r["nodes"]:
+            flags.append("nodes %d -> %d" % (o["nodes"], r["nodes"]))
+        if o["nps"] and r["nps"]:
+            flags.append("nps x%.2f" % (r["nps"] / o["nps"]))
+        lines.append("%-14s %-10s %s" % (r["position"], r["engine"],
+                                         ", ".join(flags)))
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    g = parser.add_mutually_exclusive_group()
+    g.add_argument("--csv", nargs="+", metavar="FILE",
+                   help="positions read from CSV files (Player 1 to move)")
+    g.add_argument("--store", metavar="STORE",
+                   help="positions sampled from a game store")
+    parser.add_argument("--sample", type=int, default=10,
+                        help="number of positions sampled from the store" +
+                             " (default: %(default)s)")
+    parser.add_argument("-e", "--engine", action="append",
+                        choices=sorted(ENGINES),
+                        help="search to run, may be repeated (default: all)")
+    parser.add_argument("-d", "--depth", type=int,
+                        help="maximal depth of the minimax searches" +
+                             " (default: 2 without --time)")
+    parser.add_argument("-t", "--time", type=float,
+                        help="time after which the minimax searches stop" +
+                             " deepening and the MCTS searches stop, in" +
+                             " seconds")
+    parser.add_argument("-n", "--simulations", type=int, default=300,
+                        help="MCTS simulations (default: %(default)s)")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="MCTS root parallel worker processes, to measure" +
+                             " the scaling with --time (default: %(default)s)")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="write the results as JSON to FILE")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare with the JSON results in FILE")
+    args = parser.parse_args()
+
+    if args.depth is None and args.time is None:
+        args.depth = 2
+    if args.workers < 1:
+        parser.error("the number of workers must be at least 1")
+    budget = Budget(args.depth, args.time, args.simulations, args.workers)
+    if args.csv is not None:
+        suite = csv_suite(args.csv)
+    elif args.store is not None:
+        suite = store_suite(args.store, args.sample)
+    else:
+        suite = builtin_suite()
+
+    print("%-14s %-10s %5s %10s %8s %10s %6s  %s" % (
+        "position", "engine", "depth", "nodes", "seconds", "nodes/s", "ebf",
+        "move"))
+    results = run(suite, args.engine or sorted(ENGINES), budget,
+                  lambda r: print(format_result(r), flush=True))
+    output = {"revision": git_revision(), "budget": budget.to_dict(),
+              "results": results}
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print("Compared with %s (revision %s):" % (args.compare,
+                                                  old.get("revision")))
+        for line in compare(old, output):
+            print(line)
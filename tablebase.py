@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Endgame tablebase of Avalam.
+
+A tower is frozen once no move can take it or bring a tower onto it: it
+then stays as it is until the end of the game, as heights only grow and
+emptied cells stay empty. Removing the frozen towers leaves the towers
+that still interact, and their configuration alone, whatever its place on
+the board, decides the rest of the game.
+
+The tablebase holds the exact outcome of every configuration of up to K
+interacting towers forming a connected group, and of the configurations
+reached from them. They are solved by a memoized negamax. Outcomes are
+(towers, maximal height towers) differences at the end of the game, from
+the point of view of the side to move. Compared lexicographically, they
+order the results as Board.get_score does, so the optimal play for them is
+also optimal for the result of the game, whatever the frozen towers add.
+
+Configurations are keyed by their position-independent encoding, the
+smallest over the 8 symmetries of the board of 12 bits per tower (row,
+column and height, the side to move having positive heights). The keys of
+up to 5 towers fit in 64 bits. The tablebase is stored in the layout of
+game_store.write_arrays under the magic b"AVEB", keys sorted, and probed
+by binary search. Configurations missing from the file (groups that are
+not connected) are solved on the fly when probed.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import itertools
+import time
+
+import numpy as np
+
+from avalam import Board, PLAYER1
+from game_store import map_arrays, write_arrays
+
+TABLEBASE_MAGIC = b"AVEB"
+TABLEBASE_VERSION = 1
+MAX_TOWERS = 5  # 12 bits per tower in a 64 bits key
+
+NEIGHBOURS = [(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1)
+              if di or dj]
+SYMMETRIES = [lambda i, j: (i, j), lambda i, j: (i, -j),
+              lambda i, j: (-i, j), lambda i, j: (-i, -j),
+              lambda i, j: (j, i), lambda i, j: (j, -i),
+              lambda i, j: (-j, i), lambda i, j: (-j, -i)]
+
+
+def is_frozen(cells, i, j, max_height):
+    """Return whether the tower (i, j) of cells ({(i, j): value}) can no
+    longer move nor be moved onto."""
+    h = abs(cells[i, j])
+    for di, dj in NEIGHBOURS:
+        v = cells.get((i + di, j + dj))
+        if v and h + abs(v) <= max_height:
+            return False
+    return True
+
+
+def split_frozen(cells, max_height):
+    """Remove the frozen towers from cells ({(i, j): value}, modified in
+    place) and return their (towers, maximal height towers) difference."""
+    towers = top = 0
+    for (i, j) in [c for c in cells if is_frozen(cells, c[0], c[1],
+                                                 max_height)]:
+        v = cells.pop((i, j))
+        towers += 1 if v > 0 else -1
+        if abs(v) == max_height:
+            top += 1 if v > 0 else -1
+    return towers, top
+
+
+def board_cells(board, limit=None):
+    """Return (cells, towers, top): the interacting towers of board as
+    {(i, j): value} and the difference of towers and maximal height towers
+    among the frozen ones, from the point of view of Player 1.
+
+    Return None as soon as more than limit towers interact.
+
+    """
+    m = board.m
+    rows, columns, max_height = board.rows, board.columns, board.max_height
+    cells = {}
+    towers = top = 0
+    for i in range(rows):
+        row = m[i]
+        for j in range(columns):
+            v = row[j]
+            if v == 0:
+                continue
+            h = v if v > 0 else -v
+            frozen = True
+            if h < max_height:
+                for di, dj in NEIGHBOURS:
+                    i2, j2 = i + di, j + dj
+                    if 0 <= i2 < rows and 0 <= j2 < columns:
+                        w = m[i2][j2]
+                        if w and h + (w if w > 0 else -w) <= max_height:
+                            frozen = False
+                            break
+            if frozen:
+                towers += 1 if v > 0 else -1
+                if h == max_height:
+                    top += 1 if v > 0 else -1
+            else:
+                cells[i, j] = v
+                if limit is not None and len(cells) > limit:
+                    return None
+    return cells, towers, top
+
+
+def config_key(cells, max_height):
+    """Return the position-independent 64 bits key of cells."""
+    best = None
+    for symmetry in SYMMETRIES:
+        moved = [symmetry(i, j) + (v,) for (i, j), v in cells.items()]
+        i0 = min(i for i, j, v in moved)
+        j0 = min(j for i, j, v in moved)
+        key = 0
+        for i, j, v in sorted((i - i0, j - j0, v) for i, j, v in moved):
+            key = (key << 12) | (i << 8) | (j << 4) | (v + max_height + 1)
+        if best is None or key < best:
+            best = key
+    return best
+
+
+def config_cells(key, max_height):
+    """Return the cells ({(i, j): value}) of one of the configurations of
+    key, the inverse of config_key up to symmetry and translation."""
+    cells = {}
+    while key:
+        code = key & 0xfff
+        key >>= 12
+        cells[code >> 8, (code >> 4) & 0xf] = (code & 0xf) - max_height - 1
+    return cells
+
+
+class Solver:
+
+    """Memoized negamax on configurations of interacting towers."""
+
+    def __init__(self, max_height=Board.max_height):
+        self.max_height = max_height
+        self.memo = {0: (0, 0)}
+
+    def solve(self, cells):
+        """Return the (towers, maximal height towers) difference at the end
+        of the game of the interacting towers cells ({(i, j): value}), for
+        the side to move (positive values) under optimal play."""
+        if not cells:
+            return 0, 0
+        key = config_key(cells, self.max_height)
+        value = self.memo.get(key)
+        if value is not None:
+            return value
+        best = None
+        for (i, j), v in cells.items():
+            h = abs(v)
+            for di, dj in NEIGHBOURS:
+                w = cells.get((i + di, j + dj))
+                if not w or h + abs(w) > self.max_height:
+                    continue
+                # the opponent moves next: values negated
+                child = {c: -x for c, x in cells.items() if c != (i, j)}
+                child[i + di, j + dj] = -(h + abs(w)) if v > 0 else h + abs(w)
+                towers, top = split_frozen(child, self.max_height)
+                t, m = self.solve(child)
+                value = (-towers - t, -top - m)
+                if best is None or value > best:
+                    best = value
+        self.memo[key] = best
+        return best
+
+
+def connected_shapes(size):
+    """Return the groups of size cells, connected through the 8
+    neighbourhood, up to translation and symmetry."""
+    shapes = {((0, 0),)}
+    for n in range(1, size):
+        grown = {}
+        for shape in shapes:
+            for (i, j) in shape:
+                for di, dj in NEIGHBOURS:
+                    c = (i + di, j + dj)
+                    if c in shape:
+                        continue
+                    cells = dict.fromkeys(shape + (c,), 1)
+                    key = config_key(cells, 0)
+                    if key not in grown:
+                        grown[key] = tuple(cells)
+        shapes = set(grown.values())
+    return sorted(shapes)
+
+
+def build_tablebase(path, k=4, max_height=Board.max_height, log=None):
+    """Solve every connected configuration of up to k interacting towers
+    and the configurations reached from them, and write them to path.
+
+    Return the number of configurations written.
+
+    """
+    if not 1 <= k <= MAX_TOWERS:
+        raise ValueError("k must be between 1 and %d" % MAX_TOWERS)
+    solver = Solver(max_height)
+    heights = [v for h in range(1, max_height) for v in (h, -h)]
+    for size in range(2, k + 1):
+        start = time.perf_counter()
+        for shape in connected_shapes(size):
+            for values in itertools.product(heights, repeat=size):
+                cells = dict(zip(shape, values))
+                if split_frozen(dict(cells), max_height) != (0, 0) or \
+                        any(is_frozen(cells, i, j, max_height)
+                            for i, j in cells):
+                    continue
+                solver.solve(cells)
+        if log is not None:
+            log("%d towers: %d configurations solved in %.1fs" %
+                (size, len(solver.memo), time.perf_counter() - start))
+    keys = np.array(sorted(solver.memo), np.uint64)
+    write_arrays(path, TABLEBASE_MAGIC, TABLEBASE_VERSION,
+                 {"max_height": max_height, "k": k},
+                 {"keys": keys,
+                  "values": np.array([solver.memo[int(key)] for key in keys],
+                                     np.int8).reshape(-1, 2)})
+    return len(keys)
+
+
+class Tablebase:
+
+    """Read-only, memory-mapped view of a tablebase written by
+    build_tablebase, completed by on the fly solving."""
+
+    def __init__(self, path):
+        try:
+            self.buf, header, arrays = map_arrays(path, TABLEBASE_MAGIC,
+                                                  TABLEBASE_VERSION)
+        except ValueError:
+            raise ValueError("not an Avalam tablebase: %s" % path)
+        self.max_height = header["max_height"]
+        self.k = header["k"]
+        self.keys = arrays["keys"]
+        self.values = arrays["values"]
+        self.solver = Solver(self.max_height)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, cells):
+        """Return the outcome of the interacting towers cells, for the side
+        to move (positive values), as Solver.solve does."""
+        if not cells:
+            return 0, 0
+        key = config_key(cells, self.max_height)
+        k = int(np.searchsorted(self.keys, np.uint64(key)))
+        if k < len(self.keys) and int(self.keys[k]) == key:
+            return int(self.values[k, 0]), int(self.values[k, 1])
+        return self.solver.solve(cells)
+
+    def probe(self, board, player):
+        """Return the exact (towers, maximal height towers) difference at
+        the end of the game from board, player being to move, from the
+        point of view of Player 1, or None if more than k towers interact.
+        """
+        if board.max_height != self.max_height:
+            return None
+        found = board_cells(board, self.k)
+        if found is None:
+            return None
+        cells, towers, top = found
+        if player != PLAYER1:
+            cells = {c: -v for c, v in cells.items()}
+        t, m = self.lookup(cells)
+        if player != PLAYER1:
+            t, m = -t, -m
+        return towers + t, top + m
+
+    def probe_score(self, board, player):
+        """Return the final score of the game from board, as
+        Board.get_score, or None if more than k towers interact."""
+        value = self.probe(board, player)
+        if value is None:
+            return None
+        return value[0] if value[0] != 0 else value[1]
+
+    def best_action(self, board, player):
+        """Return (action, outcome) for an optimal move of player on board,
+        or None if more than k towers interact or the game is over."""
+        if self.probe(board, player) is None:
+            return None
+        best = None
+        for action in board.get_actions():
+            t, m = self.probe(board.clone().play_action(action), -player)
+            if best is None or (t * player, m * player) > best[2]:
+                best = (action, (t, m), (t * player, m * player))
+        return None if best is None else best[:2]
+
+    def close(self):
+        self.keys = self.values = None
+        self.buf.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tablebase", help="tablebase file to write")
+    parser.add_argument("-k", "--towers", type=int, default=4,
+                        help="maximal number of interacting towers, at most" +
+                             " %d (default: %%(default)s)" % MAX_TOWERS)
+    args = parser.parse_args()
+
+    if not 1 <= args.towers <= MAX_TOWERS:
+        parser.error("the number of towers must be between 1 and %d" %
+                     MAX_TOWERS)
+    start = time.perf_counter()
+    n = build_tablebase(args.tablebase, args.towers,
+                        log=lambda message: print(message, flush=True))
+    print("%d configurations written to %s in %.1fs" %
+          (n, args.tablebase, time.perf_counter() - start))
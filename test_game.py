@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests of the game runner.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import agent_protocol
+from avalam import Board
+from game import Game, GameAgentProxy, connect_game_agent
+from greedy_player import GreedyAgent
+
+
+class BinaryGameIdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.uri = "unix://" + os.path.join(self.directory.name, "agent.sock")
+        threading.Thread(target=agent_protocol.serve_agent_binary,
+                         args=(GreedyAgent(), self.uri), daemon=True).start()
+        path = agent_protocol.parse_address(self.uri)[1]
+        while not os.path.exists(path):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_game_id_with_binary_agents(self):
+        """A game id is not passed to binary protocol agents."""
+        agents = [connect_game_agent(self.uri, "test:%d" % (i + 1))
+                  for i in range(2)]
+        for agent in agents:
+            self.assertIsInstance(agent, agent_protocol.BinaryAgentProxy)
+            self.assertNotIsInstance(agent, GameAgentProxy)
+        game = Game(agents, Board(), None, [10, 10])
+        try:
+            game.startPlaying()
+        finally:
+            for agent in agents:
+                agent.close()
+        self.assertEqual(game.trace.reason, "")
+        self.assertTrue(game.board.is_finished())
+
+
+if __name__ == "__main__":
+    unittest.main()
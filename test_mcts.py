@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Tests of the MCTS agent.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import random
+import unittest
+
+from avalam import Board
+from custom_board import ActiveCellBoard
+from my_player_MCTS import make_search
+
+
+class NodePoolTest(unittest.TestCase):
+
+    def test_recycled_boards(self):
+        """The boards of recycled nodes match boards built from scratch."""
+        random.seed(0)
+        root = make_search("tree", ActiveCellBoard(), max_nodes=50)
+        root.search(600)
+        self.assertTrue(root.pool.free, "no node was recycled")
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children)
+            expected = ActiveCellBoard(node.state.m)
+            self.assertEqual(sorted(node.state.get_actions()),
+                             sorted(Board(node.state.m).get_actions()))
+            self.assertEqual(node.state.active, expected.active)
+            self.assertEqual(node.state.frozen, expected.frozen)
+            self.assertEqual(node.state.get_hash(), expected.get_hash())
+            self.assertEqual(node.state.is_finished(),
+                             Board(node.state.m).is_finished())
+            self.assertEqual(node.state.get_score(),
+                             Board(node.state.m).get_score())
+
+
+if __name__ == "__main__":
+    unittest.main()
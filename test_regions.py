@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests of the region decomposition of endgames.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import random
+import unittest
+
+import perft
+from avalam import Board
+from regions import RegionSolver
+from tablebase import board_cells, config_cells, config_key
+
+
+class PeakRegionSolver(RegionSolver):
+
+    """RegionSolver recording the largest size of its caches."""
+
+    peak = 0
+
+    def solve(self, keys):
+        value = super().solve(keys)
+        self.peak = max(self.peak, len(self.memo), len(self.cells))
+        return value
+
+
+class RegionSolverTest(unittest.TestCase):
+
+    def test_config_cells(self):
+        """config_cells gives back a configuration of the key."""
+        random.seed(0)
+        for _ in range(200):
+            cells = {(random.randrange(9), random.randrange(9)):
+                     random.choice([-3, -2, -1, 1, 2, 4])
+                     for _ in range(random.randint(1, 10))}
+            key = config_key(cells, Board.max_height)
+            self.assertEqual(config_key(config_cells(key, Board.max_height),
+                                        Board.max_height), key)
+
+    def test_max_entries(self):
+        """The caches stay below max_entries during a search, which gives
+        the outcomes of an unbounded one."""
+        random.seed(0)
+        bounded = 0
+        for _ in range(6):
+            board = Board(random.choice(perft.POSITIONS)[1])
+            while board_cells(board, 12) is None:
+                board.play_action(random.choice(list(board.get_actions())))
+            cells = board_cells(board)[0]
+            solver = PeakRegionSolver(limit=12, max_entries=50)
+            value = solver.lookup(cells)
+            self.assertLessEqual(solver.peak, 50)
+            unbounded = PeakRegionSolver(limit=12)
+            self.assertEqual(value, unbounded.lookup(cells))
+            bounded += unbounded.peak > 50
+        self.assertTrue(bounded, "no search reached max_entries")
+
+
+if __name__ == "__main__":
+    unittest.main()
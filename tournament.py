@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Headless Avalam tournament runner.
+
+Plays many games concurrently in a process pool. Every game launches its
+two agents, each pinned to its own core, and drives them with game.Game
+exactly like `game.py --headless` would. Agents are either scripts served
+over XML-RPC or agent classes ("path.py:ClassName") run in a child
+process connected by a pipe.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import concurrent.futures
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+from avalam import Board
+from game import Game, connect_agent, is_agent_spec, load_agent
+
+
+_worker_cores = None
+
+
+def available_cores():
+    """Return the sorted list of cores this process may run on."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def _init_worker(counter, cores):
+    """Pool initializer: reserve two cores for the agents of this worker."""
+    global _worker_cores
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    _worker_cores = (cores[(2 * index) % len(cores)],
+                     cores[(2 * index + 1) % len(cores)])
+
+
+def free_port():
+    """Return a TCP port that is currently free on localhost."""
+    s = socket.socket()
+    try:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+def start_agent(command, port, core=None, timeout=20.0):
+    """Launch the agent server described by command on port.
+
+    Arguments:
+    command -- agent script followed by its own options, e.g.
+        "my_player_MCTS.py -n 200"
+    port -- port number to serve on
+    core -- core to pin the agent to, or None to leave it unpinned
+    timeout -- number of seconds to wait for the server to accept
+        connections
+
+    Return the subprocess.Popen of the server.
+
+    """
+    argv = shlex.split(command)
+    proc = subprocess.Popen([sys.executable] + argv[:1] +
+                            ["-b", "127.0.0.1", "-p", str(port)] + argv[1:],
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    pin(proc.pid, core)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None or time.time() > deadline:
+                proc.kill()
+                raise RuntimeError("agent %r did not start" % command)
+            time.sleep(0.05)
+
+
+def pin(pid, core):
+    """Pin process pid to core if the platform allows it."""
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(pid, {core})
+        except OSError as e:
+            logging.warning("Unable to pin agent to core %d: %s", core, e)
+
+
+def play_game(task):
+    """Pool task: play one game and return its record as a dictionary."""
+    game_id, agent1, agent2, time_credit, trace_dir = task
+    procs = []
+    local_agents = []
+    try:
+        agents = []
+        for command, core in zip((agent1, agent2), _worker_cores or (None, None)):
+            if is_agent_spec(command):
+                agent = load_agent(command, isolate=True)
+                pin(agent.pid, core)
+                local_agents.append(agent)
+                agents.append(agent)
+                continue
+            port = free_port()
+            procs.append(start_agent(command, port, core))
+            agents.append(connect_agent("http://127.0.0.1:%d" % port))
+        credits = [time_credit, time_credit]
+        game = Game(agents, Board(), None, list(credits))
+        start = time.time()
+        game.play()
+        duration = time.time() - start
+    finally:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+        for agent in local_agents:
+            agent.close()
+    if trace_dir is not None:
+        with open(os.path.join(trace_dir, "game_%05d.trace" % game_id), "wb") as f:
+            game.trace.write(f)
+    times = [sum(t for p, a, t in game.trace.actions if p == player)
+             for player in (1, -1)]
+    return {"type": "game",
+            "id": game_id,
+            "agents": [agent1, agent2],
+            "winner": game.trace.winner,
+            "reason": game.trace.reason,
+            "steps": len(game.trace.actions),
+            "time_used": times,
+            "duration": duration}
+
+
+def schedule(agents, gauntlet=None, games=1):
+    """Return the list of (agent1, agent2) pairings to play.
+
+    Every pairing is played games times with each agent as Player 1. In
+    gauntlet mode, only the games of gauntlet against the others are
+    scheduled, otherwise a full round robin is.
+
+    """
+    if gauntlet is not None:
+        pairs = [(gauntlet, a) for a in agents if a != gauntlet]
+    else:
+        pairs = list(itertools.combinations(agents, 2))
+    matches = []
+    for a, b in pairs:
+        for _ in range(games):
+            matches.append((a, b))
+            matches.append((b, a))
+    return matches
+
+
+def standings(records):
+    """Aggregate game records into per agent and per pairing statistics.
+
+    Return a dictionary with keys "agents", mapping each agent to its
+    wins, draws, losses and average score margin, and "pairs", mapping
+    "A vs B" to the same statistics from the point of view of A.
+
+    """
+    def empty():
+        return {"games": 0, "wins": 0, "draws": 0, "losses": 0, "margin": 0.0}
+
+    def add(stats, margin):
+        stats["games"] += 1
+        stats["margin"] += margin
+        if margin > 0:
+            stats["wins"] += 1
+        elif margin < 0:
+            stats["losses"] += 1
+        else:
+            stats["draws"] += 1
+
+    agents = {}
+    pairs = {}
+    for r in records:
+        a, b = r["agents"]
+        for name, other, margin in ((a, b, r["winner"]), (b, a, -r["winner"])):
+            add(agents.setdefault(name, empty()), margin)
+            add(pairs.setdefault("%s vs %s" % (name, other), empty()), margin)
+    for stats in itertools.chain(agents.values(), pairs.values()):
+        stats["margin"] /= stats["games"]
+    return {"type": "standings", "agents": agents, "pairs": pairs}
+
+
+def run_tournament(agents, output, gauntlet=None, games=1, time_credit=None,
+                   jobs=None, trace_dir=None):
+    """Play the tournament and write one JSON line per game to output,
+    followed by the standings. Return the standings.
+
+    A game that fails (agent not starting, crashing outside of its calls,
+    ...) is written as an "error" record and left out of the standings,
+    which count the failed games in "errors".
+
+    """
+    cores = available_cores()
+    if jobs is None:
+        jobs = max(1, len(cores) // 2)
+    tasks = [(i, a, b, time_credit, trace_dir)
+             for i, (a, b) in enumerate(schedule(agents, gauntlet, games))]
+    counter = multiprocessing.Value("i", 0)
+    records = []
+    errors = 0
+    start = time.time()
+    # agents run in child processes of the workers, which therefore must
+    # not be daemonic as the multiprocessing.Pool ones are
+    with concurrent.futures.ProcessPoolExecutor(
+            jobs, initializer=_init_worker, initargs=(counter, cores)) as pool:
+        futures = {pool.submit(play_game, task): task for task in tasks}
+        for future in concurrent.futures.as_completed(futures):
+            game_id, agent1, agent2 = futures[future][:3]
+            try:
+                record = future.result()
+            except Exception as e:
+                errors += 1
+                error = "%s: %s" % (type(e).__name__, e)
+                output.write(json.dumps({"type": "error", "id": game_id,
+                                         "agents": [agent1, agent2],
+                                         "error": error}) + "\n")
+                output.flush()
+                logging.error("Game %d: %s vs %s failed: %s", game_id,
+                              agent1, agent2, error)
+                continue
+            records.append(record)
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            logging.info("Game %d/%d: %s vs %s -> %+d %s", len(records),
+                         len(tasks), record["agents"][0],
+                         record["agents"][1], record["winner"],
+                         record["reason"])
+    result = standings(records)
+    result["errors"] = errors
+    result["games_per_hour"] = len(records) * 3600 / (time.time() - start)
+    output.write(json.dumps(result) + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def posfloatarg(string):
+        value = float(string)
+        if value <= 0:
+            raise argparse.ArgumentTypeError("%s is not strictly positive" %
+                                             string)
+        return value
+
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [options] AGENT AGENT [AGENT ...]")
+    parser.add_argument("agents", nargs="+", metavar="AGENT",
+                        help="agent script followed by its options, quoted" +
+                             " (e.g. \"my_player_MCTS.py -n 200\"), or" +
+                             " path.py:ClassName to skip XML-RPC")
+    parser.add_argument("-o", "--output", type=argparse.FileType("w"),
+                        default="tournament.jsonl",
+                        help="write the results to FILE" +
+                             " (default: %(default)s)",
+                        metavar="FILE")
+    parser.add_argument("--gauntlet", metavar="AGENT",
+                        help="only play AGENT against the others instead" +
+                             " of a full round robin")
+    parser.add_argument("-g", "--games", type=int, default=1,
+                        help="number of games per pairing and per color" +
+                             " (default: %(default)s)")
+    parser.add_argument("-t", "--time", type=posfloatarg,
+                        help="set the time credit per player (default:" +
+                             " untimed games)",
+                        metavar="SECONDS")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="number of concurrent games (default: half the" +
+                             " available cores, one core per agent)")
+    parser.add_argument("--traces", metavar="DIR",
+                        help="write the trace of every game in DIR")
+    parser.add_argument("-v", "--verbose", action="store_true", default=False,
+                        help="be verbose")
+    args = parser.parse_args()
+    if len(set(args.agents)) < 2:
+        parser.error("at least two different agents are needed")
+    if args.gauntlet is not None and args.gauntlet not in args.agents:
+        parser.error("the gauntlet agent must be one of the agents")
+
+    logging.basicConfig(format="%(asctime)s -- %(levelname)s: %(message)s",
+                        level=logging.INFO if args.verbose else logging.WARNING)
+    if args.traces is not None:
+        os.makedirs(args.traces, exist_ok=True)
+
+    result = run_tournament(args.agents, args.output, args.gauntlet,
+                            args.games, args.time, args.jobs, args.traces)
+    args.output.close()
+    print("%-40s %6s %6s %6s %6s %8s" % ("agent", "games", "wins", "draws",
+                                         "losses", "margin"))
+    for name, s in sorted(result["agents"].items(),
+                          key=lambda x: -x[1]["wins"]):
+        print("%-40s %6d %6d %6d %6d %+8.2f" % (name, s["games"], s["wins"],
+                                                s["draws"], s["losses"],
+                                                s["margin"]))
+    if result["errors"]:
+        print("%d games failed, see %s" % (result["errors"],
+                                           args.output.name))
+    print("%.1f games per hour" % result["games_per_hour"])